@@ -1,26 +1,84 @@
 import dataclasses
+from argparse import ArgumentParser
 from operator import itemgetter
-from typing import List, Dict, Tuple
+from time import time
+from typing import List, Dict, Tuple, Callable, Optional
 
 
 @dataclasses.dataclass
-class Crab:
-    # class attributes:
-    _exp_cost_cache = {}  # type: Dict[int, int]
+class CostModel:
+    """
+    How much fuel it costs a crab to move from `start` to `end`.
+
+    The properties are declarations used by `Swarm.solve` to pick a solver:
+    - `separable`: the cost only depends on the distance `abs(end - start)`, so it can be cached per distance.
+    - `convex`: the total cost of the swarm is convex in the target position, so we can search for the minimum.
+    - `linear`: the cost is the distance, so the best position is a median of the crabs.
+    """
+    name: str
+    cost: Callable[[int, int], int]  # (start, end) -> cost for a single crab
+    convex: bool = False
+    separable: bool = False
+    linear: bool = False
+
+    _cache: Dict[int, int] = dataclasses.field(default_factory=dict, compare=False, repr=False)
+
+    def __call__(self, start: int, end: int) -> int:
+        if not self.separable:
+            return self.cost(start, end)
+
+        distance = abs(end - start)
+        if distance not in self._cache:
+            self._cache[distance] = self.cost(start, end)
+        return self._cache[distance]
+
+
+COST_MODELS: Dict[str, CostModel] = {}
+
+
+def register_cost_model(model: CostModel) -> CostModel:
+    if model.name in COST_MODELS:
+        raise ValueError(f'A cost model named {model.name} is already registered')
+    COST_MODELS[model.name] = model
+    return model
+
+
+LINEAR = register_cost_model(CostModel(
+    'linear',
+    lambda s, e: abs(e - s),
+    convex=True,
+    separable=True,
+    linear=True,
+))
+TRIANGULAR = register_cost_model(CostModel(
+    'triangular',
+    lambda s, e: abs(e - s) * (abs(e - s) + 1) // 2,
+    convex=True,
+    separable=True,
+))
+QUADRATIC = register_cost_model(CostModel(
+    'quadratic',
+    lambda s, e: (e - s) * (e - s),
+    convex=True,
+    separable=True,
+))
+
+
+def cost_model(exponential: bool = False, model: Optional[CostModel] = None) -> CostModel:
+    """Resolve the legacy `exponential` flag into a cost model"""
+    if model is not None:
+        return model
+    return TRIANGULAR if exponential else LINEAR
+
 
+@dataclasses.dataclass
+class Crab:
     # object attributes:
     position: int = dataclasses.field()
     count: int = dataclasses.field(default=0)
 
-    def cost_to(self, p: int, exponential: bool = False):
-        cost = abs(p - self.position)
-        if exponential:
-            if cost not in self._exp_cost_cache:
-                self._exp_cost_cache[cost] = sum(range(1, cost + 1))
-
-            cost = self._exp_cost_cache[cost]
-
-        return cost * self.count
+    def cost_to(self, p: int, exponential: bool = False, model: Optional[CostModel] = None):
+        return cost_model(exponential, model)(self.position, p) * self.count
 
 
 @dataclasses.dataclass
@@ -44,35 +102,99 @@ class Swarm:
     def count(self):
         return sum((c.count for c in self.crabs))
 
-    def compute_position_cost(self, exponential: bool = False) -> Dict[int, int]:
-        """Compute the cost for each position and return the dict"""
+    def _bounds(self) -> Tuple[int, int]:
         all_position = [c.position for c in self.crabs]
-        st = min(all_position)
-        ed = max(all_position)
+        return min(all_position), max(all_position)
+
+    def total_cost(self, p: int, model: CostModel) -> int:
+        return sum((
+            c.cost_to(p, model=model)
+            for c in self.crabs
+        ))
+
+    def compute_position_cost(self, exponential: bool = False, model: Optional[CostModel] = None) -> Dict[int, int]:
+        """Compute the cost for each position and return the dict"""
+        model = cost_model(exponential, model)
+        st, ed = self._bounds()
 
         rv = {}
         # We consider all locations, even the ones without crabs at the moment
         for p in range(st, ed + 1):
-            rv[p] = sum((
-                c.cost_to(p, exponential)
-                for c in self.crabs
-            ))
+            rv[p] = self.total_cost(p, model)
 
         return rv
 
-    def best_position(self, exponential: bool = False) -> Tuple[int, int]:
+    def best_position(self, exponential: bool = False, model: Optional[CostModel] = None) -> Tuple[int, int]:
         """Return tuple position, cost"""
-        for position, cost in sorted(self.compute_position_cost(exponential).items(), key=itemgetter(1)):
+        for position, cost in sorted(self.compute_position_cost(exponential, model).items(), key=itemgetter(1)):
             # only return the first element since it's sorted by ascending cost
             return position, cost
 
+    def median_position(self, model: CostModel = LINEAR) -> Tuple[int, int]:
+        """Only valid for linear costs: the lowest median of all crabs is the best position"""
+        if not model.linear:
+            raise ValueError(f'The median is not the best position for the {model.name} cost model')
+        middle = (self.count() - 1) // 2
+        seen = 0
+        for c in sorted(self.crabs, key=lambda c: c.position):
+            seen += c.count
+            if seen > middle:
+                return c.position, self.total_cost(c.position, model)
+
+    def convex_position(self, model: CostModel) -> Tuple[int, int]:
+        """Binary search for the first position where the cost stops decreasing, only valid for convex costs"""
+        if not model.convex:
+            raise ValueError(f'The {model.name} cost model is not convex')
+        st, ed = self._bounds()
+        while st < ed:
+            middle = (st + ed) // 2
+            if self.total_cost(middle + 1, model) >= self.total_cost(middle, model):
+                ed = middle
+            else:
+                st = middle + 1
+        return st, self.total_cost(st, model)
+
+    def solve(self, model: CostModel) -> Tuple[int, int]:
+        """Return tuple position, cost using the fastest solver the cost model allows"""
+        if model.linear:
+            return self.median_position(model)
+        if model.convex:
+            return self.convex_position(model)
+        return self.best_position(model=model)
+
+    def solvers(self, model: CostModel) -> Dict[str, Callable[[], Tuple[int, int]]]:
+        """All the solvers that are valid for this cost model"""
+        rv = {'brute force': lambda: self.best_position(model=model)}
+        if model.convex:
+            rv['convex search'] = lambda: self.convex_position(model)
+        if model.linear:
+            rv['median'] = lambda: self.median_position(model)
+        return rv
 
-if __name__ == '__main__':
-    data = Swarm.from_file('input.txt')
-    print(f'Loaded {data.count()} crabs at {len(data.crabs)} positions')
-
-    best_linear, linear_cost = data.best_position()
-    print(f'Q1: best position is {best_linear} for a cost of {linear_cost}')
 
-    best_exponential, exponential_cost = data.best_position(exponential=True)
-    print(f'Q2: best position is {best_exponential} for a cost of {exponential_cost}')
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--input', type=str, default='input.txt', help='Input file')
+    parser.add_argument('--cost', type=str, choices=sorted(COST_MODELS), default=None,
+                        help='Only use this cost model, default is linear for Q1 and triangular for Q2.')
+    parser.add_argument('--benchmark', action='store_true', help='Time every solver valid for the cost model(s).')
+    args = parser.parse_args()
+
+    data = Swarm.from_file(args.input)
+    print(f'Loaded {data.count()} crabs at {len(data.crabs)} positions from {args.input}')
+
+    if args.cost is not None:
+        questions = [(args.cost, COST_MODELS[args.cost])]
+    else:
+        questions = [('Q1', LINEAR), ('Q2', TRIANGULAR)]
+
+    for question, model in questions:
+        best, cost = data.solve(model)
+        print(f'{question}: best position is {best} for a cost of {cost} ({model.name} cost)')
+
+        if args.benchmark:
+            for solver_name, solver in data.solvers(model).items():
+                model._cache.clear()  # do not let a solver benefit from the previous one
+                start = time()
+                solver()
+                print(f'  {solver_name} took {time() - start:.4f} sec')
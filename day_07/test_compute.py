@@ -1,6 +1,6 @@
 import pytest
 
-from day_07.compute import Crab, Swarm
+from day_07.compute import Crab, Swarm, CostModel, COST_MODELS, LINEAR, TRIANGULAR, QUADRATIC
 
 
 class TestCrab:
@@ -53,6 +53,36 @@ class TestSwarm:
         assert len(swarm.crabs) == 7
         assert swarm.count() == 10
 
+    @pytest.mark.parametrize('model', (LINEAR, TRIANGULAR, QUADRATIC))
+    def test_solvers_agree(self, model):
+        swarm = Swarm.from_file('example.txt')
+        expected = swarm.best_position(model=model)
+        for name, solver in swarm.solvers(model).items():
+            assert solver() == expected, name
+        assert swarm.solve(model) == expected
+
+    def test_median_position_requires_linear(self):
+        with pytest.raises(ValueError):
+            Swarm.from_file('example.txt').median_position(TRIANGULAR)
+
+    def test_custom_cost_model(self):
+        # moving right is twice as expensive as moving left, not separable but still convex
+        model = CostModel('lopsided', lambda s, e: 2 * (e - s) if e > s else s - e, convex=True)
+        swarm = Swarm.from_file('example.txt')
+        assert swarm.convex_position(model) == swarm.best_position(model=model)
+
+    def test_non_convex_uses_brute_force(self):
+        model = CostModel('capped', lambda s, e: min(abs(e - s), 3), separable=True)
+        swarm = Swarm.from_file('example.txt')
+        assert swarm.solve(model) == swarm.best_position(model=model)
+        with pytest.raises(ValueError):
+            swarm.convex_position(model)
+
+    def test_registry(self):
+        assert COST_MODELS['linear'] is LINEAR
+        assert COST_MODELS['triangular'] is TRIANGULAR
+        assert COST_MODELS['quadratic'] is QUADRATIC
+
 
 def test_q1_example():
     best_position, cost = Swarm.from_file('example.txt').best_position()
@@ -1,9 +1,13 @@
 import dataclasses
+import json
+import os
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from copy import deepcopy
 from enum import Enum
-from itertools import product
-from typing import List, Dict, Optional
+from itertools import product, permutations, islice
+from time import time
+from typing import List, Dict, Optional, Tuple, Iterable
 
 
 class Pattern(Enum):
@@ -39,27 +43,33 @@ b    .  b    .  .    c  b    c  b    c
 
     @property
     def digit(self) -> int:
-        if self == self.Zero:
-            return 0
-        elif self == self.One:
-            return 1
-        elif self == self.Two:
-            return 2
-        elif self == self.Three:
-            return 3
-        elif self == self.Four:
-            return 4
-        elif self == self.Five:
-            return 5
-        elif self == self.Six:
-            return 6
-        elif self == self.Seven:
-            return 7
-        elif self == self.Eight:
-            return 8
-        elif self == self.Nine:
-            return 9
-        raise ValueError()
+        return _PATTERN_DIGITS[self]
+
+
+# Patterns are declared in digit order
+_PATTERN_DIGITS: Dict[Pattern, int] = {p: i for i, p in enumerate(Pattern)}
+# bit of each segment letter, indexed by byte value
+_SEGMENT_BITS: List[int] = [
+    1 << (c - ord('a')) if ord('a') <= c <= ord('g') else 0
+    for c in range(256)
+]
+NO_DIGIT = 0xFF
+
+
+def to_mask(pattern: str) -> int:
+    """7-bit mask of the segments, a is the lowest bit"""
+    rv = 0
+    for l in pattern:
+        rv |= 1 << (ord(l) - ord('a'))
+    return rv
+
+
+def digit_table(masks: Dict[int, int]) -> bytes:
+    """128 entries table: mask -> digit, or NO_DIGIT"""
+    rv = bytearray([NO_DIGIT]) * 128
+    for mask, digit in masks.items():
+        rv[mask] = digit
+    return bytes(rv)
 
 
 def all_matches() -> Dict[str, List[str]]:
@@ -69,6 +79,129 @@ def all_matches() -> Dict[str, List[str]]:
     }
 
 
+@dataclasses.dataclass
+class WiringTable:
+    """
+    There are only 7! ways to wire a panel, so we can precompute the 10 patterns seen for each of them.
+    The signature of a panel is the sorted tuple of its pattern masks and maps to a `digit_table`.
+    """
+    # class attributes:
+    _default = None  # type: Optional[WiringTable]
+
+    # object attributes:
+    signatures: Dict[Tuple[int, ...], bytes]
+
+    @classmethod
+    def build(cls) -> "WiringTable":
+        digit_masks = [to_mask(p.value) for p in sorted(Pattern, key=lambda p: p.digit)]
+        rv = {}
+        for wiring in permutations(range(7)):
+            wired = {}
+            for digit, mask in enumerate(digit_masks):
+                wired_mask = 0
+                for segment in range(7):
+                    if mask & (1 << segment):
+                        wired_mask |= 1 << wiring[segment]
+                wired[wired_mask] = digit
+            rv[tuple(sorted(wired))] = digit_table(wired)
+        return cls(rv)
+
+    def to_file(self, filename: str):
+        with open(filename, 'w') as f:
+            json.dump([
+                [list(signature), [digits[m] for m in signature]]
+                for signature, digits in self.signatures.items()
+            ], f)
+
+    @classmethod
+    def from_file(cls, filename: str) -> "WiringTable":
+        with open(filename, 'r') as f:
+            return cls({
+                tuple(signature): digit_table(dict(zip(signature, digits)))
+                for signature, digits in json.load(f)
+            })
+
+    @classmethod
+    def load(cls, filename: Optional[str] = None) -> "WiringTable":
+        """Build the table, or load it from `filename` that is written on first use"""
+        if filename is not None and os.path.exists(filename):
+            return cls.from_file(filename)
+        rv = cls.build()
+        if filename is not None:
+            rv.to_file(filename)
+        return rv
+
+    @classmethod
+    def default(cls) -> "WiringTable":
+        if cls._default is None:
+            cls._default = cls.build()
+        return cls._default
+
+    def decode(self, patterns: Iterable[int], output: Iterable[int]) -> int:
+        digits = self.signatures[tuple(sorted(patterns))]
+        v = 0
+        for o in output:
+            d = digits[o]
+            if d == NO_DIGIT:
+                raise ValueError(f'No translation for {o:07b}')
+            v = v * 10 + d
+        return v
+
+    def value(self, panel: "Panel") -> int:
+        return self.decode(map(to_mask, panel.patterns), map(to_mask, panel.output))
+
+
+@dataclasses.dataclass
+class BatchResult:
+    lines: int = 0
+    easy_matches: int = 0  # Q1
+    values: int = 0  # Q2
+    duration: float = 0
+
+    @property
+    def throughput(self) -> float:
+        """Lines per second"""
+        return self.lines / self.duration if self.duration else 0.0
+
+    def merge(self, other: "BatchResult"):
+        self.lines += other.lines
+        self.easy_matches += other.easy_matches
+        self.values += other.values
+
+
+def word_mask(word: bytes) -> int:
+    return sum(map(_SEGMENT_BITS.__getitem__, word))
+
+
+def decode_line(line: bytes, table: Optional[WiringTable] = None) -> int:
+    """Decode the output value of a line as read from the input file"""
+    if table is None:
+        table = WiringTable.default()
+    patterns, output = line.split(b'|')
+    return table.decode(map(word_mask, patterns.split()), map(word_mask, output.split()))
+
+
+_EASY_SIZES = frozenset((2, 3, 4, 7))  # 1, 7, 4 and 8
+
+
+def _init_worker(wiring_cache: Optional[str]):
+    """Load the table once per worker process, so `decode_lines` uses it as the default table"""
+    if wiring_cache is not None:
+        WiringTable._default = WiringTable.load(wiring_cache)
+
+
+def decode_lines(lines: List[bytes], table: Optional[WiringTable] = None) -> BatchResult:
+    """Compute Q1 and Q2 for the lines without creating `Panel` objects"""
+    if table is None:
+        table = WiringTable.default()
+    rv = BatchResult()
+    for line in lines:
+        rv.lines += 1
+        rv.easy_matches += sum(1 for o in line.split(b'|')[1].split() if len(o) in _EASY_SIZES)
+        rv.values += decode_line(line, table)
+    return rv
+
+
 @dataclasses.dataclass
 class Panel:
     easy_patterns = (Pattern.One, Pattern.Four, Pattern.Seven, Pattern.Eight)
@@ -171,25 +304,69 @@ class Panel:
                 # We found a valid combination!
                 return match
 
+    @classmethod
+    def bitmask_match(cls, patterns: List[str]) -> Dict[str, Pattern]:
+        """
+        Identify every pattern using the intersection with the masks of 1 and 4, the only ones we need since:
+        - 2, 3, 5 have 5 segments: 3 contains 1, 5 shares 3 segments with 4 and 2 only 2.
+        - 0, 6, 9 have 6 segments: 9 contains 4, 0 contains 1 and 6 does not.
+        """
+        masks = {p: to_mask(p) for p in patterns}
+        one = next(m for p, m in masks.items() if len(p) == 2)
+        four = next(m for p, m in masks.items() if len(p) == 4)
+
+        rv = {}
+        for p, m in masks.items():
+            size = len(p)
+            if size == 2:
+                rv[p] = Pattern.One
+            elif size == 3:
+                rv[p] = Pattern.Seven
+            elif size == 4:
+                rv[p] = Pattern.Four
+            elif size == 7:
+                rv[p] = Pattern.Eight
+            elif size == 5:
+                if m & one == one:
+                    rv[p] = Pattern.Three
+                elif bin(m & four).count('1') == 3:
+                    rv[p] = Pattern.Five
+                else:
+                    rv[p] = Pattern.Two
+            elif size == 6:
+                if m & four == four:
+                    rv[p] = Pattern.Nine
+                elif m & one == one:
+                    rv[p] = Pattern.Zero
+                else:
+                    rv[p] = Pattern.Six
+            else:
+                raise ValueError(f'Unexpected pattern {p}')
+        return rv
+
     def _decode_output(self):
         v = 0
-        for i, o in enumerate(reversed(self.output)):
+        for o in self.output:
             if o not in self.digit_match:
                 raise ValueError(f'No translation for {o}')
-            v += self.digit_match[o].digit * pow(10, i)
+            v = v * 10 + self.digit_match[o].digit
         return v
 
-    def value(self) -> int:
+    def bitmask_value(self) -> int:
+        """Deduce the digits from the patterns instead of looking them up in the `WiringTable`"""
+        self.digit_match.update(self.bitmask_match(self.patterns))
+
+        # We have to match all other patterns
+        return self._decode_output()
+
+    def value(self, table: Optional[WiringTable] = None) -> int:
         if self.output_value is not None:
             return self.output_value
 
         # Otherwise we have to compute it
-        self.easy_match()
-        for k, v in self.hard_match(self.patterns, self.segment_match).items():
-            self._add_match(v, k)
-
-        # We have to match all other patterns
-        self.output_value = self._decode_output()
+        if table is None:
+            table = WiringTable.default()
+        self.output_value = table.value(self)
         return self.output_value
 
     @classmethod
@@ -215,6 +392,42 @@ class Panel:
                 rv.append(cls.from_str(line.replace('\n', '')))
         return rv
 
+    @classmethod
+    def stream_values(
+        cls, filename: str, workers: int = 1, chunk_size: int = 10000, wiring_cache: Optional[str] = None,
+    ) -> BatchResult:
+        """
+        Compute Q1 and Q2 reading `filename` by chunks of `chunk_size` lines, without keeping the panels.
+        With more than 1 worker the chunks are decoded in a process pool, at most 2 chunks per worker are pending.
+        The wiring table is loaded from `wiring_cache`, by every worker, see `WiringTable.load`.
+        """
+        rv = BatchResult()
+        start = time()
+        with open(filename, 'rb') as f:
+            chunks = iter(lambda: list(islice(f, chunk_size)), [])
+            if workers <= 1:
+                table = WiringTable.default() if wiring_cache is None else WiringTable.load(wiring_cache)
+                for chunk in chunks:
+                    rv.merge(decode_lines(chunk, table))
+            else:
+                if wiring_cache is not None:
+                    # write the cache before the workers start so they all read it instead of building the table
+                    WiringTable.load(wiring_cache)
+                with ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_worker, initargs=(wiring_cache,),
+                ) as executor:
+                    pending = set()
+                    for chunk in chunks:
+                        if len(pending) >= 2 * workers:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for d in done:
+                                rv.merge(d.result())
+                        pending.add(executor.submit(decode_lines, chunk))
+                    for d in pending:
+                        rv.merge(d.result())
+        rv.duration = time() - start
+        return rv
+
     @classmethod
     def count_easy_match(cls, data: List["Panel"]) -> int:
         return sum((
@@ -223,9 +436,11 @@ class Panel:
         ))
 
     @classmethod
-    def all_values(cls, data: List["Panel"]) -> int:
+    def all_values(cls, data: List["Panel"], table: Optional[WiringTable] = None) -> int:
+        if table is None:
+            table = WiringTable.default()
         return sum((
-            p.value()
+            p.value(table)
             for p in data
         ))
 
@@ -233,13 +448,29 @@ class Panel:
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--input', type=str, default='input.txt', help='Input file')
+    parser.add_argument('--wiring-cache', type=str, default=None,
+                        help='File caching the table of all wirings, created if it does not exist.')
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help='Stream the input by chunks decoded with this number of processes. '
+                             'Give more than one to compare the throughput.')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='Number of lines per chunk when streaming, default is %(default)s.')
     args = parser.parse_args()
 
-    data = Panel.from_file(args.input)
-    print(f'Loaded {len(data)} from {args.input}')
-
-    q1 = Panel.count_easy_match(data)
-    print(f'Q1: number of 1, 4, 7 or 8 in data: {q1}')
-
-    q2 = Panel.all_values(data)
-    print(f'Q2: sum of all values: {q2}')
+    if args.workers:
+        for workers in args.workers:
+            result = Panel.stream_values(args.input, workers, args.chunk_size, args.wiring_cache)
+            print(f'{workers} workers: {result.lines} lines in {result.duration:.2f} sec '
+                  f'({result.throughput:.0f} lines/sec)')
+            print(f'  Q1: number of 1, 4, 7 or 8 in data: {result.easy_matches}')
+            print(f'  Q2: sum of all values: {result.values}')
+    else:
+        wiring = WiringTable.load(args.wiring_cache)
+        data = Panel.from_file(args.input)
+        print(f'Loaded {len(data)} from {args.input}')
+
+        q1 = Panel.count_easy_match(data)
+        print(f'Q1: number of 1, 4, 7 or 8 in data: {q1}')
+
+        q2 = Panel.all_values(data, wiring)
+        print(f'Q2: sum of all values: {q2}')
@@ -2,7 +2,36 @@ from typing import List
 
 import pytest
 
-from day_08.compute import Panel, Pattern
+from day_08.compute import Panel, Pattern, WiringTable, to_mask, decode_line, digit_table
+
+
+@pytest.mark.parametrize('pattern, expected', (
+    ('a', 0b1),
+    ('cf', 0b100100),
+    ('abcdefg', 0b1111111),
+))
+def test_to_mask(pattern, expected):
+    assert to_mask(pattern) == expected
+
+
+def test_digit_table():
+    table = digit_table({0b1: 3, 0b1111111: 8})
+    assert len(table) == 128
+    assert table[0b1] == 3
+    assert table[0b1111111] == 8
+    assert table[0b10] == 0xFF
+
+
+@pytest.mark.parametrize('line, expected', (
+    (b'acedgfb cdfbe gcdfa fbcad dab cefabd cdfgeb eafb cagedb ab | cdfeb fcadb cdfeb cdbaf', 5353),
+    (b'be cfbegad cbdgef fgaecd cgeb fdcge agebfd fecdb fabcd edb | fdgacbe cefdb cefbgd gcbe\n', 8394),
+))
+def test_decode_line(line, expected):
+    assert decode_line(line) == expected
+
+
+def test_pattern_digit():
+    assert [p.digit for p in Pattern] == list(range(10))
 
 
 class TestPannel:
@@ -180,6 +209,21 @@ class TestPannel:
             assert k in rv, f'Not in {rv.keys()}'
             assert rv[k] == v
 
+    def test_bitmask_match(self):
+        panel = Panel.from_str(self.small_example)
+        assert panel.bitmask_match(panel.patterns) == {
+            'ab': Pattern.One,
+            'acdfg': Pattern.Two,
+            'abcdf': Pattern.Three,
+            'abef': Pattern.Four,
+            'bcdef': Pattern.Five,
+            'bcdefg': Pattern.Six,
+            'abd': Pattern.Seven,
+            'abcdefg': Pattern.Eight,
+            'abcdef': Pattern.Nine,
+            'abcdeg': Pattern.Zero,
+        }
+
     @pytest.mark.parametrize('value, exp', (
         (small_example, 5353),
         ('be cfbegad cbdgef fgaecd cgeb fdcge agebfd fecdb fabcd edb | fdgacbe cefdb cefbgd gcbe', 8394),
@@ -188,6 +232,13 @@ class TestPannel:
         panel = Panel.from_str(value)
         assert panel.value() == exp
 
+    def test_bitmask_value(self):
+        assert Panel.from_str(self.small_example).bitmask_value() == 5353
+
+    def test_value_as_decode_line(self):
+        panel = Panel.from_str(self.small_example)
+        assert panel.value(WiringTable.default()) == decode_line(self.small_example.encode()) == 5353
+
     def test_value_from_example(self):
         data = Panel.from_file('example.txt')
         assert [
@@ -207,6 +258,43 @@ class TestPannel:
         ]
 
 
+class TestWiringTable:
+
+    def test_build(self):
+        table = WiringTable.build()
+        assert len(table.signatures) == 5040
+
+    def test_value(self):
+        data = Panel.from_file('example.txt')
+        table = WiringTable.default()
+        assert [table.value(p) for p in data] == [p.bitmask_value() for p in data]
+
+    def test_load(self, tmp_path):
+        filename = str(tmp_path / 'wiring.json')
+        created = WiringTable.load(filename)
+        assert WiringTable.load(filename) == created
+
+
+@pytest.mark.parametrize('workers', (1, 2))
+def test_stream_values(workers):
+    result = Panel.stream_values('example.txt', workers, chunk_size=3)
+    assert result.lines == 10
+    assert result.easy_matches == 26
+    assert result.values == 61229
+
+
+@pytest.mark.parametrize('workers', (1, 2))
+def test_stream_values_wiring_cache(tmp_path, workers):
+    # a cache where every pattern shows a 1, to check it is the table that was used
+    filename = str(tmp_path / 'wiring.json')
+    WiringTable({
+        signature: digit_table({m: 1 for m in signature})
+        for signature in WiringTable.default().signatures
+    }).to_file(filename)
+    result = Panel.stream_values('example.txt', workers, chunk_size=3, wiring_cache=filename)
+    assert result.values == 10 * 1111
+
+
 def test_example_q1():
     assert Panel.count_easy_match(Panel.from_file('example.txt')) == 26
 
@@ -1,6 +1,19 @@
 import dataclasses
+import heapq
+import math
+import mmap
 from argparse import ArgumentParser
-from typing import Iterator, Dict, List, Set
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from time import time
+from typing import Iterator, Iterable, Dict, List, Set, Tuple, Sequence, Optional
+
+# byte value -> height, anything that is not a digit (like new lines) is a mountain
+_HEIGHTS = bytes(
+    c - ord('0') if ord('0') <= c <= ord('9') else 9
+    for c in range(256)
+)
 
 
 @dataclasses.dataclass(frozen=True)
@@ -39,6 +52,253 @@ class Location:
         return self.height < other.height
 
 
+@dataclasses.dataclass
+class DisjointSet:
+    """Union-find where the root of a set is its smallest element"""
+    parent: List[int] = dataclasses.field(default_factory=list)
+
+    def add(self) -> int:
+        self.parent.append(len(self.parent))
+        return len(self.parent) - 1
+
+    def find(self, a: int) -> int:
+        parent = self.parent
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]  # path halving
+            a = parent[a]
+        return a
+
+    def union(self, a: int, b: int) -> int:
+        a = self.find(a)
+        b = self.find(b)
+        if a < b:
+            self.parent[b] = a
+            return a
+        self.parent[a] = b
+        return b
+
+
+def label_basins(cells: Sequence[int], stride: int, rows: int, mountain: int = 9) -> Tuple[List[int], Counter]:
+    """
+    Label the connected areas below `mountain` of a row-major grid in two passes:
+    first give a provisional label from the cell above or on the left, merging both when they differ,
+    then replace each label by the root of its set.
+    Return the label of each cell (0 for mountains) and the size of each label.
+    """
+    sets = DisjointSet([0])  # 0 is the label of mountains
+    labels = [0] * (stride * rows)
+    for i in range(stride * rows):
+        if cells[i] >= mountain:
+            continue
+        up = labels[i - stride] if i >= stride else 0
+        left = labels[i - 1] if i % stride else 0
+        if up and left:
+            labels[i] = up if up == left else sets.union(up, left)
+        elif up or left:
+            labels[i] = up or left
+        else:
+            labels[i] = sets.add()
+
+    roots = [sets.find(l) for l in range(len(sets.parent))]
+    labels = [roots[l] for l in labels]
+    sizes = Counter(labels)
+    del sizes[0]
+    return labels, sizes
+
+
+def largest_risk(sizes: Iterable[int], n: int = 3) -> int:
+    return math.prod(heapq.nlargest(n, sizes))
+
+
+def low_points(cells: Sequence[int], stride: int) -> Iterator[int]:
+    """
+    Offsets of the low points of a row-major grid, the first and last rows are only used as neighbours.
+    The cells before and after each row must be mountains (border or new line).
+    """
+    c = cells
+    s = stride
+    n = len(c)
+    # compare every cell with its 4 neighbours in a single pass, mountains are never lower than anything
+    for i, (h, up, left, right, down) in enumerate(zip(
+        c[s:n - s],
+        c[:n - 2 * s],
+        c[s - 1:n - s - 1],
+        c[s + 1:n - s + 1],
+        c[2 * s:],
+    ), start=s):
+        if h < up and h < left and h < right and h < down:
+            yield i
+
+
+@dataclasses.dataclass
+class BandScan:
+    """What we need to know about a band of rows to stitch it with its neighbours"""
+    risk_level: int
+    basin_sizes: List[int]  # the largest basins that do not touch the first or last row
+    first_labels: List[int]  # label of each cell of the first row, 0 for mountains
+    last_labels: List[int]  # label of each cell of the last row, 0 for mountains
+    edge_sizes: Dict[int, int]  # label -> size for basins touching the first or last row
+
+    @classmethod
+    def scan(cls, cells: Sequence[int], stride: int, top: int = 3) -> "BandScan":
+        """`cells` are the heights of the band with an extra row before and after it"""
+        rows = len(cells) // stride - 2
+        risk_level = sum((
+            cells[i] + 1
+            for i in low_points(cells, stride)
+        ))
+
+        labels, sizes = label_basins(cells[stride:-stride], stride, rows)
+        first_labels = labels[:stride]
+        last_labels = labels[-stride:]
+        edges = (set(first_labels) | set(last_labels)) - {0}
+        return cls(
+            risk_level,
+            heapq.nlargest(top, (v for l, v in sizes.items() if l not in edges)),
+            first_labels,
+            last_labels,
+            {l: sizes[l] for l in edges},
+        )
+
+
+@dataclasses.dataclass
+class BasinStitcher:
+    """
+    Merge consecutive bands: basins touching the boundary between two bands are joined with a union-find.
+    Only the basins that may still grow are tracked, the others are reduced to the `top` largest.
+    """
+    top: int = 3
+    risk_level: int = 0
+    largest: List[int] = dataclasses.field(default_factory=list)  # min heap of the largest complete basins
+    sizes: Dict[int, int] = dataclasses.field(default_factory=dict)  # open basin -> size
+    previous: Optional[List[int]] = None  # open basin of each cell of the last row added
+
+    def _keep(self, size: int):
+        if len(self.largest) < self.top:
+            heapq.heappush(self.largest, size)
+        elif size > self.largest[0]:
+            heapq.heapreplace(self.largest, size)
+
+    def add(self, band: BandScan):
+        self.risk_level += band.risk_level
+        for size in band.basin_sizes:
+            self._keep(size)
+
+        sets = DisjointSet(list(range(len(self.sizes) + 1)))  # 0 is for mountains, open basins are 1..n
+        sizes = dict(self.sizes)
+        edges = {}
+        for label, size in band.edge_sizes.items():
+            edges[label] = sets.add()
+            sizes[edges[label]] = size
+
+        if self.previous is not None:
+            for a, b in zip(self.previous, band.first_labels):
+                if a and b:
+                    sets.union(a, edges[b])
+
+        merged: Dict[int, int] = {}
+        for label, size in sizes.items():
+            root = sets.find(label)
+            merged[root] = merged.get(root, 0) + size
+
+        # basins not on the last row will not grow anymore, renumber the others 1..n
+        still_open = {}
+        for label in band.last_labels:
+            if label:
+                root = sets.find(edges[label])
+                if root not in still_open:
+                    still_open[root] = len(still_open) + 1
+        for root, size in merged.items():
+            if root not in still_open:
+                self._keep(size)
+        self.sizes = {still_open[root]: merged[root] for root in still_open}
+        self.previous = [
+            still_open[sets.find(edges[label])] if label else 0
+            for label in band.last_labels
+        ]
+
+    def largest_basins(self) -> List[int]:
+        return heapq.nlargest(self.top, self.largest + list(self.sizes.values()))
+
+    def largest_basins_risk(self) -> int:
+        return math.prod(self.largest_basins())
+
+    @classmethod
+    def from_file(cls, filename: str, strip_rows: int = 1024, top: int = 3) -> "BasinStitcher":
+        """
+        Scan the memory-mapped `filename` by strips of `strip_rows` rows: only the current strip and the
+        labels of the last row of the previous one are in memory.
+        """
+        rv = cls(top)
+        with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            width = data.find(b'\n')
+            if width == -1:
+                width = len(data)
+            stride = width + 1  # the new line is a mountain between rows
+            rows = (len(data) + 1) // stride  # the last new line is optional
+            border = b'9' * stride
+
+            for first in range(0, rows, strip_rows):
+                last = min(first + strip_rows, rows)
+                strip = data[max(first - 1, 0) * stride:(last + 1) * stride]
+                if first == 0:
+                    strip = border + strip
+                if len(strip) % stride:
+                    strip += b'\n'
+                if last == rows:
+                    strip += border
+                rv.add(BandScan.scan(strip.translate(_HEIGHTS), stride, top))
+        return rv
+
+    @classmethod
+    def parallel(cls, filename: str, workers: int = 4, bands: Optional[int] = None, top: int = 3) -> "BasinStitcher":
+        """
+        Load the heights in shared memory and scan `bands` horizontal bands (default: 1 per worker)
+        in a process pool, each band reads one extra row above and below. Bands are stitched in order.
+        """
+        with open(filename, 'rb') as f:
+            data = f.read()
+        width = data.find(b'\n')
+        if width == -1:
+            width = len(data)
+        stride = width + 1
+        if len(data) % stride:
+            data += b'\n'
+        rows = len(data) // stride
+        border = b'9' * stride
+        grid = (border + data + border).translate(_HEIGHTS)
+
+        if bands is None:
+            bands = workers
+        band_rows = max(1, -(-rows // bands))  # ceil
+
+        rv = cls(top)
+        shm = shared_memory.SharedMemory(create=True, size=len(grid))
+        try:
+            shm.buf[:len(grid)] = grid
+            del grid
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_scan_shared_band, shm.name, stride, first, min(first + band_rows, rows), top)
+                    for first in range(0, rows, band_rows)
+                ]
+                for future in futures:
+                    rv.add(future.result())
+        finally:
+            shm.close()
+            shm.unlink()
+        return rv
+
+
+def _scan_shared_band(name: str, stride: int, first: int, last: int, top: int) -> BandScan:
+    """Scan rows `first` to `last` (excluded) of the grid in shared memory, where row 0 is after the border"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return BandScan.scan(bytes(shm.buf[first * stride:(last + 2) * stride]), stride, top)
+    finally:
+        shm.close()
+
+
 @dataclasses.dataclass
 class Map:
     points: Dict[Point, Location]
@@ -115,30 +375,115 @@ class Map:
         ))
 
     def largest_basins_risk(self, n: int = 3) -> int:
-        basin_sizes = sorted(
-            (
-                len(b)
-                for b in self.basins
-            ),
-            reverse=True,
-        )
-        rv = basin_sizes[0]
-        for i in range(1, min(len(basin_sizes), n)):
-            rv *= basin_sizes[i]
-        return rv
+        return largest_risk((len(b) for b in self.basins), n)
+
+
+@dataclasses.dataclass
+class HeightMap:
+    """
+    Heights in a flat row-major buffer with a border of 9s all around the grid,
+    so the neighbours of the cell at `i` are always at `i ± 1` and `i ± stride`.
+    """
+    width: int
+    height: int
+    cells: bytearray
+
+    @property
+    def stride(self) -> int:
+        return self.width + 2
+
+    @classmethod
+    def from_file(cls, filename: str) -> "HeightMap":
+        cells = bytearray()
+        width = None
+        height = 0
+        with open(filename, 'rb') as f:
+            for line in f:
+                line = line.rstrip(b'\r\n')
+                if width is None:
+                    width = len(line)
+                    cells += bytes([9]) * (width + 2)
+                elif len(line) != width:
+                    raise ValueError(f'Line {height} has {len(line)} heights instead of {width}')
+                cells += bytes([9]) + line.translate(_HEIGHTS) + bytes([9])
+                height += 1
+        if width is None:
+            raise ValueError(f'No heights in {filename}')
+        cells += bytes([9]) * (width + 2)
+        return cls(width, height, cells)
+
+    def low_points(self) -> Iterator[int]:
+        """Offsets of the low points in `cells`"""
+        return low_points(self.cells, self.stride)
+
+    def risk_level(self) -> int:
+        c = self.cells
+        return sum((
+            c[i] + 1
+            for i in self.low_points()
+        ))
+
+    def basin_sizes(self) -> Counter:
+        """Size of each basin, the 9s split the grid into basins"""
+        _, sizes = label_basins(self.cells, self.stride, self.height + 2)
+        return sizes
+
+    def largest_basins_risk(self, n: int = 3) -> int:
+        return largest_risk(self.basin_sizes().values(), n)
 
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--input', type=str, default='input.txt', help='Input file')
+    parser.add_argument('--engine', type=str, choices=('map', 'flat', 'tiled', 'parallel'), default='map',
+                        help='Use a dict of locations (map), a flat buffer of heights (flat), '
+                             'read the file by strips (tiled) or scan bands in parallel (parallel), '
+                             'default is %(default)s.')
+    parser.add_argument('--strip-rows', type=int, default=1024,
+                        help='Number of rows per strip for the tiled engine, default is %(default)s.')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of processes for the parallel engine, default is %(default)s.')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Time the parallel engine with 1, 2, 4 and 8 workers.')
     args = parser.parse_args()
 
-    map = Map.from_file(args.input)
-    print(f'Loaded {len(map.points)} points of a {map.width}x{map.height} grid')
-    print(f'Found {len(map.basins)} basins')
+    if args.benchmark:
+        reference = None
+        for workers in (1, 2, 4, 8):
+            start = time()
+            result = BasinStitcher.parallel(args.input, workers)
+            duration = time() - start
+            if reference is None:
+                reference = duration
+            print(f'{workers} workers: {duration:.2f} sec (speedup x{reference / duration:.2f}), '
+                  f'risk level {result.risk_level}, basin risk level {result.largest_basins_risk()}')
+    elif args.engine in ('tiled', 'parallel'):
+        if args.engine == 'tiled':
+            tiled = BasinStitcher.from_file(args.input, args.strip_rows)
+        else:
+            tiled = BasinStitcher.parallel(args.input, args.workers)
+
+        q1 = tiled.risk_level
+        print(f'Q1: direct risk level: {q1}')
+
+        q2 = tiled.largest_basins_risk()
+        print(f'Q2: basin risk level: {q2} (largest basins: {tiled.largest_basins()})')
+    elif args.engine == 'flat':
+        flat = HeightMap.from_file(args.input)
+        print(f'Loaded a {flat.width}x{flat.height} grid')
+
+        q1 = flat.risk_level()
+        print(f'Q1: direct risk level: {q1}')
+
+        q2 = flat.largest_basins_risk()
+        print(f'Q2: basin risk level: {q2}')
+    else:
+        map = Map.from_file(args.input)
+        print(f'Loaded {len(map.points)} points of a {map.width}x{map.height} grid')
+        print(f'Found {len(map.basins)} basins')
 
-    q1 = map.risk_level()
-    print(f'Q1: direct risk level: {q1}')
+        q1 = map.risk_level()
+        print(f'Q1: direct risk level: {q1}')
 
-    q2 = map.largest_basins_risk()
-    print(f'Q2: basin risk level: {q2}')
+        q2 = map.largest_basins_risk()
+        print(f'Q2: basin risk level: {q2}')
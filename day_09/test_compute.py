@@ -1,6 +1,6 @@
 import pytest
 
-from day_09.compute import Map, Location, Point
+from day_09.compute import Map, Location, Point, HeightMap, DisjointSet, BasinStitcher, label_basins
 
 
 class TestPoint:
@@ -108,6 +108,87 @@ class TestMap:
         ]
 
 
+class TestHeightMap:
+    def test_from_file(self):
+        flat = HeightMap.from_file('example.txt')
+        assert flat.width == 10
+        assert flat.height == 5
+        assert len(flat.cells) == 12 * 7
+        assert flat.cells[:12] == bytes([9] * 12)
+        assert flat.cells[12:24] == bytes([9, 2, 1, 9, 9, 9, 4, 3, 2, 1, 0, 9])
+
+    def test_low_points(self):
+        flat = HeightMap.from_file('example.txt')
+        assert [
+            ((i % flat.stride) - 1, (i // flat.stride) - 1)
+            for i in flat.low_points()
+        ] == [(1, 0), (9, 0), (2, 2), (6, 4)]
+
+    def test_risk_level(self):
+        assert HeightMap.from_file('example.txt').risk_level() == 15
+        assert HeightMap.from_file('input.txt').risk_level() == 516
+
+    def test_basin_sizes(self):
+        assert sorted(HeightMap.from_file('example.txt').basin_sizes().values()) == [3, 9, 9, 14]
+
+    def test_largest_basins_risk(self):
+        assert HeightMap.from_file('example.txt').largest_basins_risk() == 1134
+        assert HeightMap.from_file('input.txt').largest_basins_risk() == 1023660
+
+
+class TestBasinStitcher:
+    @pytest.mark.parametrize('strip_rows', (1, 2, 3, 1024))
+    def test_example(self, strip_rows):
+        tiled = BasinStitcher.from_file('example.txt', strip_rows)
+        assert tiled.risk_level == 15
+        assert tiled.largest_basins() == [14, 9, 9]
+
+    @pytest.mark.parametrize('strip_rows', (1, 7, 1024))
+    def test_input(self, strip_rows):
+        tiled = BasinStitcher.from_file('input.txt', strip_rows)
+        assert tiled.risk_level == 516
+        assert tiled.largest_basins_risk() == 1023660
+
+    @pytest.mark.parametrize('workers, bands', (
+        (1, None),
+        (2, None),
+        (2, 7),
+    ))
+    def test_parallel(self, workers, bands):
+        result = BasinStitcher.parallel('input.txt', workers, bands)
+        assert result.risk_level == 516
+        assert result.largest_basins_risk() == 1023660
+
+    def test_u_shape(self, tmp_path):
+        # both branches are only joined on the last strip
+        filename = tmp_path / 'u_shape.txt'
+        filename.write_text('191\n191\n191\n111\n')
+        tiled = BasinStitcher.from_file(str(filename), 1, top=2)
+        assert tiled.largest_basins() == [9]
+        assert tiled.risk_level == 0
+
+
+def test_disjoint_set():
+    sets = DisjointSet()
+    a, b, c = sets.add(), sets.add(), sets.add()
+    assert sets.union(c, b) == b
+    assert sets.union(b, a) == a
+    assert sets.find(c) == a
+
+
+def test_label_basins():
+    # a U shape: both branches only join on the last row
+    cells = [
+        1, 9, 1,
+        1, 9, 1,
+        1, 1, 1,
+    ]
+    labels, sizes = label_basins(cells, 3, 3)
+    assert len(sizes) == 1
+    assert list(sizes.values()) == [7]
+    assert labels[1] == 0
+
+
 def test_q1_example():
     assert Map.from_file('example.txt').risk_level() == 15
 
@@ -1,6 +1,13 @@
 import dataclasses
+import heapq
+import os
+import shutil
+import tempfile
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from itertools import cycle, islice
+from time import time
 from typing import List, Optional, Tuple
 
 
@@ -58,6 +65,25 @@ class Delim(Enum):
         return closing_map.get(self)
 
 
+# 256 entries tables indexed by byte value for `Parser.validate_bytes`, built from `Delim`
+_OPENING_OF = bytearray(256)  # closing delimiter -> its opening delimiter, 0 otherwise
+_IS_OPENING = bytearray(256)  # 1 for opening delimiters
+_CORRUPTED_POINTS = [0] * 256  # closing delimiter -> points
+_AUTOCOMPLETE_POINTS = [0] * 256  # opening delimiter -> points of the delimiter closing it
+for _d in Delim:
+    if _d.is_closing:
+        _OPENING_OF[ord(_d.value)] = ord(_d.opening().value)
+        _CORRUPTED_POINTS[ord(_d.value)] = _d.corrupted_points
+    else:
+        _IS_OPENING[ord(_d.value)] = 1
+        _AUTOCOMPLETE_POINTS[ord(_d.value)] = _d.closing().autocomplete_points
+_CLOSING_TABLE = bytes.maketrans(
+    bytes(ord(d.value) for d in Delim if not d.is_closing),
+    bytes(ord(d.closing().value) for d in Delim if not d.is_closing),
+)
+del _d
+
+
 class CorruptedLine(RuntimeError):
 
     def __init__(self, chunk: Delim, line: str, idx: int):
@@ -71,6 +97,76 @@ class CorruptedLine(RuntimeError):
         return self.delim.corrupted_points
 
 
+@dataclasses.dataclass
+class RunningMedian:
+    """Keep the middle value `sorted(values)[len(values) // 2]` with the lower half in a max heap"""
+    low: List[int] = dataclasses.field(default_factory=list)  # negated values
+    high: List[int] = dataclasses.field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.low) + len(self.high)
+
+    def add(self, value: int):
+        heapq.heappush(self.high, -heapq.heappushpop(self.low, -value))
+        if len(self.high) > len(self.low) + 1:
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+
+    def median(self) -> int:
+        return self.high[0]  # raise IndexError when empty, like `sorted([])[0]`
+
+
+@dataclasses.dataclass
+class ChunkResult:
+    """Validation of a byte range of the input"""
+    lines: int = 0
+    corrupted: int = 0
+    corruption_score: int = 0
+    autocomplete_scores: List[int] = dataclasses.field(default_factory=list)
+    output: Optional[str] = None  # file holding the autocompleted lines of the range
+
+    @classmethod
+    def validate_range(cls, filename: str, start: int, end: int, output: Optional[str] = None) -> "ChunkResult":
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            lines = f.read(end - start).split(b'\n')
+        if lines[-1] == b'':
+            lines.pop(-1)  # the range ends with a new line
+
+        rv = cls(output=output)
+        out = open(output, 'wb') if output is not None else None
+        try:
+            for line in lines:
+                rv.lines += 1
+                corrupted, completion, autoc_score = Parser.validate_bytes(line)
+                if corrupted:
+                    rv.corrupted += 1
+                    rv.corruption_score += corrupted
+                else:
+                    if out is not None:
+                        out.write(line + completion + b'\n')
+                    if autoc_score != 0:
+                        rv.autocomplete_scores.append(autoc_score)
+        finally:
+            if out is not None:
+                out.close()
+        return rv
+
+
+def split_ranges(filename: str, chunk_size: int) -> List[Tuple[int, int]]:
+    """Split the file into byte ranges of about `chunk_size` that end on a new line"""
+    size = os.path.getsize(filename)
+    rv = []
+    start = 0
+    with open(filename, 'rb') as f:
+        while start < size:
+            f.seek(min(start + chunk_size, size) - 1)
+            f.readline()  # move to the end of that line
+            end = min(f.tell(), size)
+            rv.append((start, end))
+            start = end
+    return rv
+
+
 @dataclasses.dataclass
 class Parser:
     lines: List[str]
@@ -105,10 +201,116 @@ class Parser:
         return rv, score
 
     @classmethod
-    def from_file(cls, filename: str) -> "Parser":
+    def validate_bytes(cls, line: bytes) -> Tuple[int, bytes, int]:
+        """
+        Same as `validate` on bytes without creating `Delim` objects.
+        Return the corruption points (0 if not corrupted), the bytes completing the line and its autocomplete score.
+        """
+        opened_chunks = bytearray()
+        for char in line:
+            if _IS_OPENING[char]:
+                opened_chunks.append(char)
+            elif opened_chunks and _OPENING_OF[char] == opened_chunks[-1]:
+                opened_chunks.pop()  # close last chunk
+            elif _OPENING_OF[char]:
+                return _CORRUPTED_POINTS[char], b'', 0
+            else:
+                raise ValueError(f'Invalid delimiter {chr(char)!r}')
+
+        opened_chunks.reverse()
+        score = 0
+        for char in opened_chunks:
+            score = (score * 5) + _AUTOCOMPLETE_POINTS[char]
+        return 0, opened_chunks.translate(_CLOSING_TABLE), score
+
+    @classmethod
+    def fast_from_file(cls, filename: str, keep_lines: bool = True) -> "Parser":
+        """Same as `from_file` using `validate_bytes`"""
+        input_lines = 0
+        corrupted_lines = 0
+        corruption_score = 0
+        autocomplete_score = RunningMedian()
+        final_lines = []
+
+        with open(filename, 'rb') as f:
+            for line in f:
+                input_lines += 1
+                line = line.rstrip(b'\n')
+                corrupted, completion, autoc_score = cls.validate_bytes(line)
+                if corrupted:
+                    corrupted_lines += 1
+                    corruption_score += corrupted
+                else:
+                    if keep_lines:
+                        final_lines.append((line + completion).decode())
+                    if autoc_score != 0:
+                        autocomplete_score.add(autoc_score)
+
+        print(f'Loaded {input_lines} lines from {filename}, '
+              f'{corrupted_lines} were corrupted, '
+              f'{len(autocomplete_score)} were incomplete')
+        return cls(final_lines, corruption_score, autocomplete_score.median())
+
+    @classmethod
+    def parallel_from_file(
+        cls, filename: str, workers: int = 4, output: Optional[str] = None, chunk_size: int = 1 << 24,
+    ) -> "Parser":
+        """
+        Validate byte ranges of `filename` in a process pool. The autocompleted lines are not kept,
+        but if `output` is given each range writes them to a temporary file and they are joined in order.
+        """
+        ranges = split_ranges(filename, chunk_size)
+        tmp_dir = os.path.dirname(os.path.abspath(output)) if output is not None else None
+        outputs = []
+        for _ in ranges:
+            if output is None:
+                outputs.append(None)
+            else:
+                fd, name = tempfile.mkstemp(suffix='.part', dir=tmp_dir)
+                os.close(fd)
+                outputs.append(name)
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(
+                    ChunkResult.validate_range,
+                    [filename] * len(ranges),
+                    [st for st, _ in ranges],
+                    [ed for _, ed in ranges],
+                    outputs,
+                ))
+
+            total = ChunkResult()
+            autocomplete_score = RunningMedian()
+            for r in results:
+                total.lines += r.lines
+                total.corrupted += r.corrupted
+                total.corruption_score += r.corruption_score
+                for score in r.autocomplete_scores:
+                    autocomplete_score.add(score)
+
+            if output is not None:
+                with open(output, 'wb') as f:
+                    for part in outputs:
+                        with open(part, 'rb') as p:
+                            shutil.copyfileobj(p, f)
+                print(f'Wrote {total.lines - total.corrupted} lines into {output}')
+        finally:
+            for part in outputs:
+                if part is not None:
+                    os.remove(part)
+
+        print(f'Loaded {total.lines} lines from {filename} in {len(ranges)} chunks, '
+              f'{total.corrupted} were corrupted, '
+              f'{len(autocomplete_score)} were incomplete')
+        return cls([], total.corruption_score, autocomplete_score.median())
+
+    @classmethod
+    def from_file(cls, filename: str, keep_lines: bool = True) -> "Parser":
+        """Only keep the autocompleted lines if `keep_lines`"""
         input_lines = 0
         corruption_score = []
-        autocomplete_score = []
+        autocomplete_score = RunningMedian()
         final_lines = []
 
         with open(filename, 'r') as f:
@@ -120,27 +322,56 @@ class Parser:
                 except CorruptedLine as e:
                     corruption_score.append(e.points)
                 else:
-                    final_lines.append(validated_line)
+                    if keep_lines:
+                        final_lines.append(validated_line)
                     if autoc_score != 0:
-                        autocomplete_score.append(autoc_score)
+                        autocomplete_score.add(autoc_score)
 
         print(f'Loaded {input_lines} lines from {filename}, '
               f'{len(corruption_score)} were corrupted, '
               f'{len(autocomplete_score)} were incomplete')
-        # we want the middle score for autocompletion (size//2 + 1) but we're 0 base: -1 so size//2 is enough
-        middle_autocomplete = sorted(autocomplete_score)[(len(autocomplete_score) // 2)]
-        return cls(final_lines, sum(corruption_score), middle_autocomplete)
+        return cls(final_lines, sum(corruption_score), autocomplete_score.median())
 
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--input', type=str, default='input.txt', help='Input file')
     parser.add_argument('--output', type=str, default=None, help='Output file (all correct lines)')
+    parser.add_argument('--fast', action='store_true', help='Validate bytes with lookup tables.')
+    parser.add_argument('--benchmark', type=int, default=None,
+                        help='Time the fast validation of a file of that many lines made from the input.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Validate chunks of the input with that many processes, '
+                             'the output is written while validating.')
+    parser.add_argument('--chunk-size', type=int, default=1 << 24,
+                        help='Size in bytes of the chunks for --workers, default is %(default)s.')
     args = parser.parse_args()
 
-    data = Parser.from_file(args.input)
+    if args.benchmark is not None:
+        benchmark_file = f'{args.input}.{args.benchmark}'
+        with open(args.input, 'r') as src, open(benchmark_file, 'w') as dst:
+            lines = [l.replace('\n', '') for l in src]
+            for l in islice(cycle(lines), args.benchmark):
+                dst.write(l + '\n')
+        try:
+            start = time()
+            Parser.fast_from_file(benchmark_file, keep_lines=False)
+            duration = time() - start
+            print(f'Validated {args.benchmark} lines in {duration:.2f} sec ({args.benchmark / duration:.0f} lines/sec)')
+        finally:
+            os.remove(benchmark_file)
+
+    if args.workers is not None:
+        data = Parser.parallel_from_file(args.input, args.workers, args.output, args.chunk_size)
+    else:
+        # only keep the lines in memory when we need to write them
+        keep_lines = args.output is not None
+        if args.fast:
+            data = Parser.fast_from_file(args.input, keep_lines)
+        else:
+            data = Parser.from_file(args.input, keep_lines)
     print(f'Q1: corruption score: {data.corruption_score}')
     print(f'Q2: autocomplete score: {data.autocomplete_score}')
 
-    if args.output is not None:
+    if args.output is not None and args.workers is None:
         data.to_file(args.output)
@@ -1,6 +1,6 @@
 import pytest
 
-from day_10.compute import Delim, CorruptedLine, Parser
+from day_10.compute import Delim, CorruptedLine, Parser, RunningMedian, split_ranges
 
 
 class TestDelim:
@@ -63,6 +63,89 @@ class TestParser:
         assert score == exp_score
 
 
+class TestValidateBytes:
+    @pytest.mark.parametrize('value', (
+        '()',
+        '<([{}])>',
+        '[<>({}){}[([])<>]]',
+    ))
+    def test_valid_syntax(self, value):
+        assert Parser.validate_bytes(value.encode()) == (0, b'', 0)
+
+    @pytest.mark.parametrize('value, exp_delim', (
+        ('(]', Delim.CloseSquare),
+        ('{()()()>', Delim.CloseCompare),
+        ('<([]){()}[{}])', Delim.CloseRound),
+    ))
+    def test_corrupted_lines(self, value, exp_delim):
+        assert Parser.validate_bytes(value.encode()) == (exp_delim.corrupted_points, b'', 0)
+
+    @pytest.mark.parametrize('value, exp_auto, exp_score', (
+        ('[({(<(())[]>[[{[]{<()<>>', '}}]])})]', 288957),
+        ('<{([{{}}[<[[[<>{}]]]>[]]', '])}>', 294),
+    ))
+    def test_autocomplete(self, value, exp_auto, exp_score):
+        assert Parser.validate_bytes(value.encode()) == (0, exp_auto.encode(), exp_score)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            Parser.validate_bytes(b'(a)')
+
+
+@pytest.mark.parametrize('values', (
+    [5],
+    [3, 1],
+    [5, 1, 4, 2, 3],
+    [10, 10, 1, 7, 7, 2],
+    list(range(100, 0, -3)),
+))
+def test_running_median(values):
+    median = RunningMedian()
+    for i, v in enumerate(values, start=1):
+        median.add(v)
+        assert len(median) == i
+        assert median.median() == sorted(values[:i])[i // 2]
+
+
+@pytest.mark.parametrize('load', (Parser.from_file, Parser.fast_from_file))
+def test_from_file_without_lines(load):
+    parser = load('input.txt', keep_lines=False)
+    assert parser.lines == []
+    assert parser.corruption_score == 318081
+    assert parser.autocomplete_score == 4361305341
+
+
+@pytest.mark.parametrize('chunk_size', (1, 100, 1 << 24))
+def test_split_ranges(chunk_size):
+    with open('input.txt', 'rb') as f:
+        content = f.read()
+    ranges = split_ranges('input.txt', chunk_size)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(content)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert content[end - 1:end] == b'\n'
+
+
+@pytest.mark.parametrize('workers, chunk_size', (
+    (1, 1 << 24),
+    (2, 500),
+))
+def test_parallel_from_file(tmp_path, workers, chunk_size):
+    output = str(tmp_path / 'output.txt')
+    parser = Parser.parallel_from_file('input.txt', workers, output, chunk_size)
+    assert parser.corruption_score == 318081
+    assert parser.autocomplete_score == 4361305341
+
+    with open(output, 'r') as f:
+        assert [l.replace('\n', '') for l in f] == Parser.from_file('input.txt').lines
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['output.txt']
+
+
+def test_fast_from_file():
+    assert Parser.fast_from_file('input.txt') == Parser.from_file('input.txt')
+
+
 def test_example():
     parser = Parser.from_file('example.txt')
     assert parser.corruption_score == 26397, 'q1'
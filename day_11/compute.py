@@ -1,6 +1,7 @@
 import dataclasses
 from argparse import ArgumentParser
-from typing import List, Dict, Iterator
+from array import array
+from typing import List, Dict, Iterator, Iterable, Optional
 
 
 @dataclasses.dataclass(frozen=True)
@@ -16,6 +17,9 @@ class Point:
                 yield Point(x, y)
 
 
+HOLE = '.'  # how holes in the grid are written
+
+
 @dataclasses.dataclass
 class Octopus:
     location: Point
@@ -27,54 +31,122 @@ class Octopus:
 
     @classmethod
     def from_str(cls, value: str, y: int) -> List["Octopus"]:
+        # anything that is not a digit is a hole in the grid
         return [
-            cls(Point(x, y), v)
-            for x, v in enumerate(map(int, value))
+            cls(Point(x, y), int(v))
+            for x, v in enumerate(value)
+            if v.isdigit()
         ]
 
 
 @dataclasses.dataclass
-class Map:
-    octopi: Dict[Point, Octopus]
+class Topology:
+    """
+    Neighbours of every octopus, computed once, in CSR form: octopi are numbered by "slot" and
+    the neighbours of slot `i` are `neighbours[offsets[i]:offsets[i + 1]]`.
+    """
+    kinds = ('grid', 'torus')
 
-    def simulate(self, turns: int) -> int:
-        flashes = 0
+    points: List[Point]  # slot -> location
+    offsets: array
+    neighbours: array
 
-        for t in range(turns):
-            has_flashed = set()
-            to_increase = []
+    @classmethod
+    def build(cls, points: Iterable[Point], kind: str = 'grid') -> "Topology":
+        """
+        `grid` links the octopi next to each other, the grid can have any shape.
+        `torus` also links each border with the opposite one, the grid has to be a rectangle of at least 3x3.
+        """
+        if kind not in cls.kinds:
+            raise ValueError(f'Unknown topology {kind}, expected one of {cls.kinds}')
+        points = sorted(points, key=lambda p: (p.y, p.x))
+        slots = {p: i for i, p in enumerate(points)}
 
-            for o in self.octopi.values():
-                if o.increase_energy():
-                    has_flashed.add(o.location)
-                    to_increase.extend(list(o.location.neighbours()))
+        if kind == 'torus' and points:
+            min_x = min(p.x for p in points)
+            min_y = points[0].y
+            width = max(p.x for p in points) - min_x + 1
+            height = points[-1].y - min_y + 1
+            if width * height != len(points):
+                raise ValueError(f'A torus needs a rectangle grid, {len(points)} octopi is not {width}x{height}')
+            if width < 3 or height < 3:
+                # a smaller torus would link the same neighbour more than once
+                raise ValueError(f'A torus needs at least 3x3 octopi, got {width}x{height}')
 
-            # print('Before flash')
-            # for row in self.energy_grid():
-            #     print(''.join((str(e) if e < 9 else '*' for e in row)))
+        offsets = array('l', [0])
+        neighbours = array('l')
+        for p in points:
+            for n in p.neighbours():
+                if kind == 'torus':
+                    n = Point(min_x + (n.x - min_x) % width, min_y + (n.y - min_y) % height)
+                slot = slots.get(n)
+                if slot is not None:
+                    neighbours.append(slot)
+            offsets.append(len(neighbours))
+        return cls(points, offsets, neighbours)
 
-            while to_increase:
-                where = to_increase.pop(0)
 
-                o = self.octopi.get(where)
-                if o is not None and o.increase_energy():
-                    if where not in has_flashed:
-                        has_flashed.add(where)
-                        to_increase.extend(list(where.neighbours()))
+@dataclasses.dataclass
+class Map:
+    octopi: Dict[Point, Octopus]
+    topology: Optional[Topology] = dataclasses.field(default=None, compare=False, repr=False)
+
+    # octopi in slot order of the topology
+    _slots: List[Octopus] = dataclasses.field(default_factory=list, init=False, compare=False, repr=False)
+
+    def _slotted(self) -> List[Octopus]:
+        if self.topology is None or len(self.topology.points) != len(self.octopi):
+            # built on first use or if octopi were added
+            self.topology = Topology.build(self.octopi)
+            self._slots = []
+        if not self._slots:
+            self._slots = [self.octopi[p] for p in self.topology.points]
+        return self._slots
 
-            # reset energy levels and count number of flashes
-            for o in self.octopi.values():
-                if o.energy > 9:
+    def step(self) -> int:
+        """Run one step and return the number of flashes"""
+        slots = self._slotted()
+        offsets = self.topology.offsets
+        neighbours = self.topology.neighbours
+        has_flashed = bytearray(len(slots))
+        to_increase = []
+
+        for i, o in enumerate(slots):
+            if o.increase_energy():
+                has_flashed[i] = 1
+                to_increase.append(i)
+
+        flashes = len(to_increase)
+        while to_increase:
+            i = to_increase.pop()
+            for n in neighbours[offsets[i]:offsets[i + 1]]:
+                if slots[n].increase_energy() and not has_flashed[n]:
+                    has_flashed[n] = 1
+                    to_increase.append(n)
                     flashes += 1
-                    o.energy = 0
+
+        # reset energy levels of the ones that flashed
+        for o in slots:
+            if o.energy > 9:
+                o.energy = 0
 
         return flashes
 
+    def simulate(self, turns: int) -> int:
+        return sum((
+            self.step()
+            for _ in range(turns)
+        ))
+
     def simulate_until_synchronous(self) -> int:
+        if self.total_energy() == 0:
+            return 0  # already synchronised
         turns = 0
         flashes = 0
-        while self.total_energy() > 0:
-            flashes += self.simulate(1)
+        step_flashes = 0
+        while step_flashes != len(self.octopi):
+            step_flashes = self.step()
+            flashes += step_flashes
             turns += 1
             if turns % 100 == 0:
                 print(f'After {turns} turns we had {flashes} flashes')
@@ -86,7 +158,8 @@ class Map:
             for o in self.octopi.values()
         ))
 
-    def energy_grid(self) -> List[List[int]]:
+    def energy_grid(self) -> List[List[Optional[int]]]:
+        """Energy of every octopus in the bounding box of the map, holes are None"""
         points = list(self.octopi.keys())
         min_x = points[0].x
         max_x = points[0].x
@@ -102,14 +175,15 @@ class Map:
         for y in range(min_y, max_y + 1):
             row = []
             for x in range(min_x, max_x + 1):
-                row.append(self.octopi[Point(x, y)].energy)
+                o = self.octopi.get(Point(x, y))
+                row.append(None if o is None else o.energy)
             rv.append(row)
         return rv
 
     def to_file(self, filename: str):
         with open(filename, 'w') as f:
             for line in self.energy_grid():
-                f.write(''.join(map(str, line)) + '\n')
+                f.write(''.join(HOLE if e is None else str(e) for e in line) + '\n')
 
     @classmethod
     def from_str(cls, value: str, y: int) -> Dict[Point, Octopus]:
@@ -119,13 +193,149 @@ class Map:
         return rv
 
     @classmethod
-    def from_file(cls, filename: str) -> "Map":
+    def from_file(cls, filename: str, topology: str = 'grid') -> "Map":
         rv = {}
         with open(filename, 'r') as f:
             for y, line in enumerate(f):
                 rv.update(cls.from_str(line.replace('\n', ''), y))
 
-        return cls(rv)
+        return cls(rv, Topology.build(rv, topology))
+
+
+# byte value -> energy
+_ENERGIES = bytes(
+    c - ord('0') if ord('0') <= c <= ord('9') else 0
+    for c in range(256)
+)
+
+
+@dataclasses.dataclass
+class LaneGrid:
+    """
+    The energies of the grid packed in a single int: one byte ("lane") per cell of a row-major grid
+    with a border of 1 cell, so that every cell is updated at once with big int arithmetic.
+    Energies stay below 128 as a cell gains at most 1 + 8 energy per step before being reset.
+    """
+    width: int
+    height: int
+    energy: int
+
+    _ones: int = dataclasses.field(init=False, repr=False, compare=False)  # 1 in every lane
+    _inside: int = dataclasses.field(init=False, repr=False, compare=False)  # 1 in every lane not in the border
+    _threshold: int = dataclasses.field(init=False, repr=False, compare=False)  # sets bit 7 of lanes above 9
+    _shifts: List[int] = dataclasses.field(init=False, repr=False, compare=False)  # neighbour offsets, in bits
+
+    def __post_init__(self):
+        self._ones = int.from_bytes(bytes([1]) * self.cells, 'little')
+        self._threshold = self._ones * (128 - 10)
+        row = bytes([0]) + bytes([1]) * self.width + bytes([0])
+        self._inside = int.from_bytes(
+            bytes([0]) * self.stride + row * self.height + bytes([0]) * self.stride,
+            'little',
+        )
+        self._shifts = [8 * o for o in (1, self.stride - 1, self.stride, self.stride + 1)]
+
+    @property
+    def stride(self) -> int:
+        return self.width + 2
+
+    @property
+    def cells(self) -> int:
+        return self.stride * (self.height + 2)
+
+    @classmethod
+    def from_rows(cls, rows: List[bytes]) -> "LaneGrid":
+        width = len(rows[0])
+        for y, r in enumerate(rows):
+            if len(r) != width:
+                raise ValueError(f'Lanes need a rectangle grid, row {y} has {len(r)} octopi instead of {width}')
+            if not r.isdigit():
+                raise ValueError(f'Lanes cannot represent holes in the grid, row {y} is {r!r}')
+        border = bytes([0]) * (width + 2)
+        lanes = border + b''.join(
+            bytes([0]) + r.translate(_ENERGIES) + bytes([0])
+            for r in rows
+        ) + border
+        return cls(width, len(rows), int.from_bytes(lanes, 'little'))
+
+    @classmethod
+    def from_file(cls, filename: str) -> "LaneGrid":
+        with open(filename, 'rb') as f:
+            return cls.from_rows([line.rstrip(b'\r\n') for line in f])
+
+    @classmethod
+    def from_map(cls, data: Map) -> "LaneGrid":
+        return cls.from_rows([
+            ''.join(HOLE if e is None else str(e) for e in row).encode()
+            for row in data.energy_grid()
+        ])
+
+    def _flashing(self, energy: int) -> int:
+        """1 in the lanes inside the grid with an energy above 9"""
+        return ((energy + self._threshold) >> 7) & self._inside
+
+    def step(self) -> int:
+        """Run one step and return the number of flashes"""
+        energy = self.energy + self._ones
+        flashed = 0
+        new = self._flashing(energy)
+        while new:
+            flashed |= new
+            # convolution: each lane gains the number of its neighbours that just flashed
+            for shift in self._shifts:
+                energy += (new << shift) + (new >> shift)
+            new = self._flashing(energy) & ~flashed
+
+        # reset the lanes that flashed, and the border
+        self.energy = energy & ((self._inside & ~flashed) * 0xFF)
+        return bin(flashed).count('1')
+
+    def simulate(self, turns: int) -> int:
+        return sum((
+            self.step()
+            for _ in range(turns)
+        ))
+
+    def simulate_until_synchronous(self) -> int:
+        if not self.energy:
+            return 0  # already synchronised
+        turns = 0
+        step_flashes = 0
+        while step_flashes != self.width * self.height:
+            step_flashes = self.step()
+            turns += 1
+        return turns
+
+    def flashes_after(self, turns: int) -> int:
+        """
+        Same as `simulate` but stop stepping as soon as we reach a state seen before:
+        the remaining steps repeat the cycle, for example every 10 steps once synchronised.
+        """
+        seen = {self.energy: 0}  # state -> step it was seen at
+        states = [self.energy]
+        totals = [0]  # flashes after each step
+        for t in range(1, turns + 1):
+            totals.append(totals[-1] + self.step())
+            if self.energy in seen:
+                start = seen[self.energy]
+                cycles, rest = divmod(turns - t, t - start)
+                self.energy = states[start + rest]
+                return totals[t] + cycles * (totals[t] - totals[start]) + totals[start + rest] - totals[start]
+            seen[self.energy] = t
+            states.append(self.energy)
+        return totals[-1]
+
+    def energy_grid(self) -> List[List[int]]:
+        lanes = self.energy.to_bytes(self.cells, 'little')
+        return [
+            list(lanes[y * self.stride + 1:y * self.stride + 1 + self.width])
+            for y in range(1, self.height + 1)
+        ]
+
+    def to_file(self, filename: str):
+        with open(filename, 'w') as f:
+            for line in self.energy_grid():
+                f.write(''.join(map(str, line)) + '\n')
 
 
 if __name__ == '__main__':
@@ -135,10 +345,19 @@ if __name__ == '__main__':
                         help='Number of turns to run the simulation for, default is %(default)s. Only for Q1.')
     parser.add_argument('--find-sync', action='store_true', help='Use for Q2.')
     parser.add_argument('--output', type=str, default=None, help='Output file (all correct lines)')
+    parser.add_argument('--engine', type=str, choices=('map', 'lanes'), default='map',
+                        help='Simulate a dict of octopi (map) or the whole grid at once (lanes), '
+                             'default is %(default)s.')
+    parser.add_argument('--topology', type=str, choices=Topology.kinds, default='grid',
+                        help='How octopi are linked for the map engine, default is %(default)s.')
     args = parser.parse_args()
 
-    data = Map.from_file(args.input)
-    print(f'Loaded {len(data.octopi)} octopi from {args.input}')
+    if args.engine == 'lanes':
+        data = LaneGrid.from_file(args.input)
+        print(f'Loaded {data.width}x{data.height} octopi from {args.input}')
+    else:
+        data = Map.from_file(args.input, args.topology)
+        print(f'Loaded {len(data.octopi)} octopi from {args.input} ({args.topology} topology)')
 
     if args.find_sync:
         # Q2
@@ -146,7 +365,10 @@ if __name__ == '__main__':
         print(f'Q2: First sync step is after {q2} turns')
     else:
         # Q1
-        q1 = data.simulate(args.turns)
+        if args.engine == 'lanes':
+            q1 = data.flashes_after(args.turns)
+        else:
+            q1 = data.simulate(args.turns)
         print(f'Q1: Generated {q1} in {args.turns} turns')
 
     if args.output is not None:
@@ -2,7 +2,7 @@ from typing import List
 
 import pytest
 
-from day_11.compute import Map, Point
+from day_11.compute import Map, Point, LaneGrid, Topology
 
 
 class TestPoint:
@@ -23,6 +23,31 @@ class TestPoint:
         assert list(where.neighbours()) == expected
 
 
+class TestTopology:
+
+    def test_grid(self):
+        topology = Topology.build([Point(1, 1), Point(0, 0), Point(1, 0)])
+        assert topology.points == [Point(0, 0), Point(1, 0), Point(1, 1)]
+        assert list(topology.offsets) == [0, 2, 4, 6]
+        assert list(topology.neighbours) == [1, 2, 0, 2, 0, 1]
+
+    def test_torus(self):
+        topology = Topology.build([Point(x, y) for y in range(3) for x in range(4)], 'torus')
+        for i in range(len(topology.points)):
+            assert topology.offsets[i + 1] - topology.offsets[i] == 8
+        # top left corner is linked to the 3 other corners
+        corner = topology.neighbours[topology.offsets[0]:topology.offsets[1]]
+        assert {topology.points[n] for n in corner} >= {Point(3, 0), Point(0, 2), Point(3, 2)}
+
+    def test_torus_needs_rectangle(self):
+        with pytest.raises(ValueError):
+            Topology.build([Point(0, 0), Point(1, 1)], 'torus')
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            Topology.build([Point(0, 0)], 'sphere')
+
+
 class TestMap:
 
     @pytest.mark.parametrize('init, grid, exp_flashes', (
@@ -71,6 +96,101 @@ class TestMap:
     def test_q2_example(self):
         assert Map.from_file('example.txt').simulate_until_synchronous() == 195
 
+    def test_step(self):
+        data = Map.from_file('example.txt')
+        assert [data.step() for _ in range(5)] == [0, 35, 45, 16, 8]
+
+    def test_torus(self, tmp_path):
+        filename = tmp_path / 'torus.txt'
+        filename.write_text('1111\n1111\n1119\n1111\n')
+        grid = Map.from_file(str(filename))
+        torus = Map.from_file(str(filename), 'torus')
+        assert grid.step() == torus.step() == 1
+        # the flashing octopus is reset, its neighbours get 2 energy
+        assert sum(map(sum, grid.energy_grid())) == 10 * 2 + 5 * 3
+        assert sum(map(sum, torus.energy_grid())) == 7 * 2 + 8 * 3
+        # on the torus the flash reaches the first column
+        assert torus.energy_grid()[3][0] == 3
+        assert grid.energy_grid()[3][0] == 2
+
+    def test_holes(self, tmp_path):
+        filename = tmp_path / 'holes.txt'
+        filename.write_text('999\n9.9\n999\n')
+        data = Map.from_file(str(filename))
+        assert len(data.octopi) == 8
+        assert data.energy_grid() == [[9, 9, 9], [9, None, 9], [9, 9, 9]]
+        assert data.simulate_until_synchronous() == 1
+        data.to_file(str(filename))
+        assert filename.read_text() == '000\n0.0\n000\n'
+        with pytest.raises(ValueError):
+            LaneGrid.from_map(data)
+
+    @pytest.mark.parametrize('rows', ('12\n34\n', '123\n456\n', '12\n34\n56\n'))
+    def test_small_torus(self, tmp_path, rows):
+        filename = tmp_path / 'torus.txt'
+        filename.write_text(rows)
+        with pytest.raises(ValueError):
+            Map.from_file(str(filename), 'torus')
+
+
+class TestLaneGrid:
+
+    @pytest.mark.parametrize('rows', ('123\n4.6\n789\n', '123\n45\n789\n', '123\n4567\n789\n'))
+    def test_from_file_holes(self, tmp_path, rows):
+        filename = tmp_path / 'holes.txt'
+        filename.write_text(rows)
+        with pytest.raises(ValueError):
+            LaneGrid.from_file(str(filename))
+
+    def test_from_file(self):
+        data = LaneGrid.from_file('example.txt')
+        assert data.energy_grid() == Map.from_file('example.txt').energy_grid()
+
+    @pytest.mark.parametrize('init, grid, exp_flashes', (
+        (['123', '456', '543'], ['234', '567', '654'], 0),
+        (['11111', '19991', '19191', '19991', '11111'], ['34543', '40004', '50005', '40004', '34543'], 9),
+        (['4334', '5822', '7284', '7257', '6589'], ['6555', '7054', '9608', '8600', '7800'], 6),
+    ))
+    def test_step(self, init: List[str], grid: List[str], exp_flashes: int):
+        data = LaneGrid.from_rows([l.encode() for l in init])
+        assert data.step() == exp_flashes
+        assert data.energy_grid() == [list(map(int, line)) for line in grid]
+
+    @pytest.mark.parametrize('turns, exp_flashes', (
+        (10, 204),
+        (100, 1656),
+    ))
+    def test_example(self, turns, exp_flashes):
+        data = LaneGrid.from_file('example.txt')
+        assert data.simulate(turns) == exp_flashes
+
+    def test_same_as_map(self):
+        data = Map.from_file('input.txt')
+        lanes = LaneGrid.from_map(data)
+        for _ in range(20):
+            assert lanes.simulate(5) == data.simulate(5)
+            assert lanes.energy_grid() == data.energy_grid()
+
+    def test_q2_example(self):
+        assert LaneGrid.from_file('example.txt').simulate_until_synchronous() == 195
+
+    @pytest.mark.parametrize('turns', (0, 1, 100, 195, 200, 207, 1000))
+    def test_flashes_after(self, turns):
+        expected = LaneGrid.from_file('example.txt')
+        actual = LaneGrid.from_file('example.txt')
+        assert actual.flashes_after(turns) == expected.simulate(turns)
+        assert actual.energy_grid() == expected.energy_grid()
+
+    def test_flashes_after_billions(self):
+        data = LaneGrid.from_file('example.txt')
+        # synchronised after 195 steps then all 100 octopi flash every 10 steps
+        after_sync = LaneGrid.from_file('example.txt').simulate(195)
+        assert data.flashes_after(195 + 10 ** 9) == after_sync + 100 * 10 ** 8
+
+    def test_answers(self):
+        assert LaneGrid.from_file('input.txt').simulate(100) == 1615
+        assert LaneGrid.from_file('input.txt').simulate_until_synchronous() == 249
+
 
 def test_q1():
     assert Map.from_file('input.txt').simulate(100) == 1615
@@ -1,16 +1,23 @@
 import dataclasses
+import os
+import shutil
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from copy import copy
-from typing import List, Dict, Iterator, Tuple
+from typing import List, Dict, Iterator, Tuple, Iterable, Union, Optional
 
 
 @dataclasses.dataclass
 class Cave:
     name: str
     links: Dict[str, "Cave"] = dataclasses.field(default_factory=dict, compare=False)
+    big: bool = dataclasses.field(init=False, compare=False, repr=False)
+
+    def __post_init__(self):
+        self.big = self.name.upper() == self.name
 
     def is_big(self) -> bool:
-        return self.name.upper() == self.name
+        return self.big
 
     def link_with(self, other: "Cave"):
         if other.name not in self.links:
@@ -52,10 +59,21 @@ class Path:
         return str(p), p
 
     @classmethod
-    def to_file(cls, filename: str, data: List["Path"]):
-        with open(filename, 'w') as f:
+    def from_caves(cls, caves: List[Cave], special_visits: int = 0) -> "Path":
+        _, p = cls.factory(caves[0], special_visits)
+        for c in caves[1:]:
+            p.add(c)
+        return p
+
+    @classmethod
+    def to_file(cls, filename: str, data: Iterable[Union["Path", str]], buffer_size: int = 1 << 20) -> int:
+        """Write the paths as they come, return the number of paths written"""
+        written = 0
+        with open(filename, 'w', buffering=buffer_size) as f:
             for p in data:
                 f.write(str(p) + '\n')
+                written += 1
+        return written
 
     def can_visit(self, cave: Cave, exclude: List[str] = ()) -> bool:
         if cave.name not in self.leaves:
@@ -129,16 +147,220 @@ class Path:
         return [p for p in rv.values() if p.end() == end]
 
 
+@dataclasses.dataclass
+class CaveGraph:
+    """
+    Compiled form of a `Map`: caves are numbered, the links are lists of numbers
+    and the small caves visited by a path are a bitmask of their numbers.
+    """
+    names: List[str]  # id -> name
+    ids: Dict[str, int]  # name -> id
+    big: List[bool]
+    links: List[List[int]]
+    no_revisit: int  # bitmask of the caves that can never be visited twice (start and end)
+
+    @classmethod
+    def compile(cls, data: "Map") -> "CaveGraph":
+        names = list(data.store)
+        ids = {n: i for i, n in enumerate(names)}
+        for cave in data.store.values():
+            if cave.is_big() and any(n.is_big() for n in cave.neighbours()):
+                raise ValueError(f'Big cave {cave} is linked to a big cave, there are infinitely many paths')
+        return cls(
+            names,
+            ids,
+            [data.store[n].is_big() for n in names],
+            [[ids[l] for l in data.store[n].links] for n in names],
+            sum(1 << ids[n] for n in ('start', 'end') if n in ids),
+        )
+
+    def _bit(self, cave: int) -> int:
+        return 0 if self.big[cave] else 1 << cave
+
+    def start_state(self, start: int) -> "PathState":
+        return PathState((start,), self._bit(start), 0)
+
+    def moves(self, cave: int, visited: int, used: int, special_visits: int) -> Iterator[Tuple[int, int, int]]:
+        """Next cave, visited small caves and special visits used for every move possible from `cave`"""
+        for n in self.links[cave]:
+            bit = self._bit(n)
+            if visited & bit:
+                # second visit of a small cave
+                if not (bit & self.no_revisit) and used < special_visits:
+                    yield n, visited, used + 1
+            else:
+                yield n, visited | bit, used
+
+    def count_from(self, state: "PathState", end: int, special_visits: int = 0) -> int:
+        """Depth-first search memoised on (cave, visited small caves, special visits used)"""
+        memo: Dict[Tuple[int, int, int], int] = {}
+
+        def count(cave: int, visited: int, used: int) -> int:
+            if cave == end:
+                return 1
+            key = (cave, visited, used)
+            if key not in memo:
+                memo[key] = sum((
+                    count(*move)
+                    for move in self.moves(cave, visited, used, special_visits)
+                ))
+            return memo[key]
+
+        return count(state.caves[-1], state.visited, state.used)
+
+    def count_paths(self, start: int, end: int, special_visits: int = 0) -> int:
+        return self.count_from(self.start_state(start), end, special_visits)
+
+    def iter_from(self, state: "PathState", end: int, special_visits: int = 0) -> Iterator[Tuple[int, ...]]:
+        """Yield the caves of each path starting with `state`, the search shares a single stack of caves"""
+        path = list(state.caves)
+
+        def walk(cave: int, visited: int, used: int) -> Iterator[Tuple[int, ...]]:
+            if cave == end:
+                yield tuple(path)
+                return
+            for n, n_visited, n_used in self.moves(cave, visited, used, special_visits):
+                path.append(n)
+                yield from walk(n, n_visited, n_used)
+                path.pop(-1)
+
+        return walk(state.caves[-1], state.visited, state.used)
+
+    def iter_paths(self, start: int, end: int, special_visits: int = 0) -> Iterator[Tuple[int, ...]]:
+        return self.iter_from(self.start_state(start), end, special_visits)
+
+    def expand(self, start: int, end: int, special_visits: int, depth: int) -> List["PathState"]:
+        """
+        All the paths of `depth` moves from start, or less if they reached the end, in the order `iter_paths`
+        would explore them: searching from each of them in order gives the same paths in the same order.
+        """
+        rv = []
+
+        def grow(state: PathState):
+            if state.caves[-1] == end or len(state.caves) > depth:
+                rv.append(state)
+                return
+            for n, visited, used in self.moves(state.caves[-1], state.visited, state.used, special_visits):
+                grow(PathState(state.caves + (n,), visited, used))
+
+        grow(self.start_state(start))
+        return rv
+
+
+@dataclasses.dataclass(frozen=True)
+class PathState:
+    """A path being explored: its caves, the small caves it visited and how many special visits it used"""
+    caves: Tuple[int, ...]
+    visited: int
+    used: int
+
+
+# graph of the worker processes of `Map.parallel_count_paths` and `Map.parallel_write_paths`
+_worker_graph = None  # type: Optional[CaveGraph]
+
+
+def _init_worker(graph: CaveGraph):
+    global _worker_graph
+    _worker_graph = graph
+
+
+def _count_from(state: PathState, end: int, special_visits: int) -> int:
+    return _worker_graph.count_from(state, end, special_visits)
+
+
+def _write_from(states: List[PathState], end: int, special_visits: int, filename: str) -> int:
+    names = _worker_graph.names
+    return Path.to_file(filename, (
+        ','.join([names[c] for c in caves])
+        for state in states
+        for caves in _worker_graph.iter_from(state, end, special_visits)
+    ))
+
+
 @dataclasses.dataclass
 class Map:
     store: Dict[str, Cave]
 
     def find_path(self, start: str = 'start', end: str = 'end', special_visits: int = 0) -> List[Path]:
-        return Path.find_paths(
-            self.store[start],
-            self.store[end],
-            special_visits,
-        )
+        graph = CaveGraph.compile(self)
+        return [
+            Path.from_caves([self.store[graph.names[c]] for c in caves], special_visits)
+            for caves in graph.iter_paths(graph.ids[start], graph.ids[end], special_visits)
+        ]
+
+    def iter_paths(self, start: str = 'start', end: str = 'end', special_visits: int = 0) -> Iterator[str]:
+        """Same paths as `find_path` but lazily and as strings"""
+        graph = CaveGraph.compile(self)
+        names = graph.names
+        for caves in graph.iter_paths(graph.ids[start], graph.ids[end], special_visits):
+            yield ','.join([names[c] for c in caves])
+
+    def count_paths(self, start: str = 'start', end: str = 'end', special_visits: int = 0) -> int:
+        """Count the paths `find_path` would find without building them"""
+        graph = CaveGraph.compile(self)
+        return graph.count_paths(graph.ids[start], graph.ids[end], special_visits)
+
+    def parallel_count_paths(
+        self, start: str = 'start', end: str = 'end', special_visits: int = 0, workers: int = 4, depth: int = 3,
+    ) -> int:
+        """Same as `count_paths` where the paths of `depth` moves from start are counted in a process pool"""
+        graph = CaveGraph.compile(self)
+        states = graph.expand(graph.ids[start], graph.ids[end], special_visits, depth)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(graph,)) as executor:
+            return sum(executor.map(
+                _count_from,
+                states,
+                [graph.ids[end]] * len(states),
+                [special_visits] * len(states),
+            ))
+
+    def parallel_write_paths(
+        self, filename: str, start: str = 'start', end: str = 'end', special_visits: int = 0,
+        workers: int = 4, depth: int = 3, ordered: bool = True,
+    ) -> Tuple[int, List[str]]:
+        """
+        Write the paths with a process pool, each worker writes a shard `filename.<i>` from a share of the
+        paths of `depth` moves from start. Return the number of paths and the files written.
+        When `ordered`, each worker gets consecutive paths and the shards are joined in `filename`,
+        in the same order as `iter_paths`.
+        """
+        graph = CaveGraph.compile(self)
+        states = graph.expand(graph.ids[start], graph.ids[end], special_visits, depth)
+        if not states:
+            # no path leaves start, there is nothing to share between workers
+            open(filename, 'wb').close()
+            return 0, [filename]
+        if ordered:
+            size = -(-len(states) // workers)  # ceil
+            shares = [states[i:i + size] for i in range(0, len(states), size)]
+        else:
+            shares = [states[i::workers] for i in range(min(workers, len(states)))]
+        shards = [f'{filename}.{i}' for i in range(len(shares))]
+
+        keep_shards = False
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(graph,)) as executor:
+                written = sum(executor.map(
+                    _write_from,
+                    shares,
+                    [graph.ids[end]] * len(shares),
+                    [special_visits] * len(shares),
+                    shards,
+                ))
+
+            if not ordered:
+                keep_shards = True
+                return written, shards
+            with open(filename, 'wb') as f:
+                for shard in shards:
+                    with open(shard, 'rb') as s:
+                        shutil.copyfileobj(s, f)
+            return written, [filename]
+        finally:
+            if not keep_shards:
+                for shard in shards:
+                    if os.path.isfile(shard):
+                        os.remove(shard)
 
     def add_line(self, value: str):
         a, b = value.split('-')
@@ -171,15 +393,40 @@ if __name__ == '__main__':
     parser.add_argument('--end', type=str, default='end', help='Where to end to')
     parser.add_argument('--special-visits', type=int, default=0,
                         help='Number of double visits to small caves. For Q1 should be 0, for Q2 should be 1.')
+    parser.add_argument('--count-only', action='store_true', help='Only count the paths, without building them.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Explore the paths with that many processes, counts them unless --output is given.')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='Number of moves from start to explore before sharing the work, default is %(default)s.')
+    parser.add_argument('--ordered', action='store_true',
+                        help='With --workers and --output: write a single file in the same order as without workers, '
+                             'otherwise each worker writes its own file.')
     args = parser.parse_args()
 
     map_data = Map.from_file(args.input)
     print(f'Loaded {len(map_data.store)} entries from {args.input}')
 
-    print(f'Computing paths from {args.start} to {args.end} with {args.special_visits} double visits')
-    paths = map_data.find_path(args.start, args.end, args.special_visits)
-    print(f'Found {len(paths)} paths from {args.start} to {args.end}')
-
-    if args.output:
-        print(f'Writing paths into {args.output}')
-        Path.to_file(args.output, paths)
+    if args.workers is not None:
+        print(f'Exploring paths from {args.start} with {args.workers} workers from depth {args.depth}')
+        if args.output:
+            count, files = map_data.parallel_write_paths(
+                args.output, args.start, args.end, args.special_visits, args.workers, args.depth, args.ordered,
+            )
+            print(f'Wrote {count} paths from {args.start} to {args.end} into {", ".join(files)}')
+        else:
+            count = map_data.parallel_count_paths(
+                args.start, args.end, args.special_visits, args.workers, args.depth,
+            )
+            print(f'Counted {count} paths from {args.start} to {args.end} with {args.special_visits} double visits')
+    elif args.count_only:
+        count = map_data.count_paths(args.start, args.end, args.special_visits)
+        print(f'Counted {count} paths from {args.start} to {args.end} with {args.special_visits} double visits')
+    else:
+        print(f'Computing paths from {args.start} to {args.end} with {args.special_visits} double visits')
+        if args.output:
+            print(f'Writing paths into {args.output}')
+            count = Path.to_file(args.output, map_data.iter_paths(args.start, args.end, args.special_visits))
+        else:
+            graph = CaveGraph.compile(map_data)
+            count = sum(1 for _ in graph.iter_paths(graph.ids[args.start], graph.ids[args.end], args.special_visits))
+        print(f'Found {count} paths from {args.start} to {args.end}')
@@ -1,6 +1,6 @@
 import pytest
 
-from day_12.compute import Map, Cave, Path
+from day_12.compute import Map, Cave, Path, CaveGraph
 
 
 @pytest.fixture
@@ -41,6 +41,117 @@ class TestMap:
         for name, links in expected_links.items():
             assert sorted(simplest_example.store[name].links.keys()) == links
 
+    @pytest.mark.parametrize('filename, special_visits, expected', (
+        ('example_1.txt', 0, 19),
+        ('example_2.txt', 0, 226),
+        ('example_1.txt', 1, 103),
+        ('example_2.txt', 1, 3509),
+        ('input.txt', 0, 4970),
+        ('input.txt', 1, 137948),
+    ))
+    def test_count_paths(self, filename, special_visits, expected):
+        assert Map.from_file(filename).count_paths('start', 'end', special_visits) == expected
+
+    @pytest.mark.parametrize('special_visits', (0, 1, 2))
+    def test_count_paths_simplest_example(self, simplest_example, special_visits):
+        expected = len(simplest_example.find_path('start', 'end', special_visits))
+        assert simplest_example.count_paths('start', 'end', special_visits) == expected
+
+    def test_iter_paths(self, simplest_example):
+        paths = simplest_example.iter_paths('start', 'end', 1)
+        assert next(paths) == str(simplest_example.find_path('start', 'end', 1)[0])
+        assert len(list(paths)) == 36 - 1
+
+    def test_to_file(self, simplest_example, tmp_path):
+        filename = str(tmp_path / 'paths.txt')
+        assert Path.to_file(filename, simplest_example.iter_paths()) == 10
+        with open(filename, 'r') as f:
+            assert [l.replace('\n', '') for l in f] == list(map(str, simplest_example.find_path()))
+
+    @pytest.mark.parametrize('workers, depth', (
+        (1, 0),
+        (2, 3),
+        (2, 50),
+    ))
+    def test_parallel_count_paths(self, workers, depth):
+        data = Map.from_file('example_2.txt')
+        assert data.parallel_count_paths('start', 'end', 1, workers, depth) == 3509
+
+    @pytest.mark.parametrize('depth', (0, 2, 4))
+    def test_parallel_write_paths_ordered(self, simplest_example, tmp_path, depth):
+        filename = str(tmp_path / 'paths.txt')
+        count, files = simplest_example.parallel_write_paths(filename, special_visits=1, workers=3, depth=depth)
+        assert count == 36
+        assert files == [filename]
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['paths.txt']
+        with open(filename, 'r') as f:
+            assert [l.replace('\n', '') for l in f] == list(simplest_example.iter_paths(special_visits=1))
+
+    def test_parallel_write_paths_shards(self, simplest_example, tmp_path):
+        filename = str(tmp_path / 'paths.txt')
+        count, files = simplest_example.parallel_write_paths(filename, special_visits=1, workers=2, ordered=False)
+        assert count == 36
+        assert files == [filename + '.0', filename + '.1']
+        paths = []
+        for shard in files:
+            with open(shard, 'r') as f:
+                paths += [l.replace('\n', '') for l in f]
+        assert sorted(paths) == sorted(simplest_example.iter_paths(special_visits=1))
+
+    @pytest.mark.parametrize('ordered', (True, False))
+    def test_parallel_write_paths_dead_end(self, tmp_path, ordered):
+        data = Map({})
+        for line in ('start-a', 'b-end'):
+            data.add_line(line)
+        filename = str(tmp_path / 'paths.txt')
+        assert data.parallel_write_paths(filename, workers=2, depth=2, ordered=ordered) == (0, [filename])
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['paths.txt']
+        with open(filename, 'r') as f:
+            assert f.read() == ''
+
+    def test_parallel_write_paths_failure(self, simplest_example, tmp_path):
+        filename = str(tmp_path / 'paths.txt')
+        (tmp_path / 'paths.txt.1').mkdir()  # the second worker cannot write its shard
+        with pytest.raises(IsADirectoryError):
+            simplest_example.parallel_write_paths(filename, special_visits=1, workers=2, ordered=False)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['paths.txt.1']
+
+    def test_count_paths_big_caves_linked(self):
+        data = Map({})
+        for line in ('start-A', 'A-B', 'B-end'):
+            data.add_line(line)
+        with pytest.raises(ValueError):
+            data.count_paths()
+
+
+class TestCaveGraph:
+    def test_compile(self, simplest_example):
+        graph = CaveGraph.compile(simplest_example)
+        assert graph.names == ['start', 'A', 'b', 'c', 'd', 'end']
+        assert graph.big == [False, True, False, False, False, False]
+        assert graph.links[graph.ids['d']] == [graph.ids['b']]
+        assert graph.no_revisit == 0b100001
+
+    def test_iter_paths(self, simplest_example):
+        graph = CaveGraph.compile(simplest_example)
+        paths = [
+            ','.join(graph.names[c] for c in p)
+            for p in graph.iter_paths(graph.ids['start'], graph.ids['end'])
+        ]
+        assert len(paths) == 10
+        assert set(paths) == set(map(str, Path.find_paths(simplest_example.store['start'],
+                                                          simplest_example.store['end'])))
+
+    @pytest.mark.parametrize('depth', (0, 1, 3, 20))
+    def test_expand(self, simplest_example, depth):
+        graph = CaveGraph.compile(simplest_example)
+        start, end = graph.ids['start'], graph.ids['end']
+        paths = []
+        for state in graph.expand(start, end, 1, depth):
+            assert len(state.caves) <= depth + 1
+            paths += list(graph.iter_from(state, end, 1))
+        assert paths == list(graph.iter_paths(start, end, 1))
+
 
 class TestPath:
     @classmethod
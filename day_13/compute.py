@@ -1,7 +1,11 @@
 import dataclasses
+import random
 from argparse import ArgumentParser
+from array import array
 from enum import Enum
-from typing import Set, List, Tuple
+from operator import add
+from time import time
+from typing import Set, List, Tuple, Iterable, Optional
 
 
 @dataclasses.dataclass(frozen=True)
@@ -15,6 +19,59 @@ class Point:
         return Point(x, y)
 
 
+_DOT_CHARS = bytes.maketrans(b'\x00\x01', b'.#')
+
+
+def render(width: int, height: int, xs: Iterable[int], ys: Iterable[int]) -> List[str]:
+    """Rows of the paper with a dot at each (x, y): mark a bitset of all cells then translate it in one go"""
+    cells = bytearray(width * height)
+    for x, y in zip(xs, ys):
+        cells[y * width + x] = 1
+    image = cells.translate(_DOT_CHARS).decode()
+    return [
+        image[y * width:(y + 1) * width]
+        for y in range(height)
+    ]
+
+
+GLYPH_WIDTH = 5  # 4 columns and a blank one between letters
+GLYPH_HEIGHT = 6
+_GLYPHS = {
+    'A': ('.##.', '#..#', '#..#', '####', '#..#', '#..#'),
+    'B': ('###.', '#..#', '###.', '#..#', '#..#', '###.'),
+    'C': ('.##.', '#..#', '#...', '#...', '#..#', '.##.'),
+    'E': ('####', '#...', '###.', '#...', '#...', '####'),
+    'F': ('####', '#...', '###.', '#...', '#...', '#...'),
+    'G': ('.##.', '#..#', '#...', '#.##', '#..#', '.###'),
+    'H': ('#..#', '#..#', '####', '#..#', '#..#', '#..#'),
+    'J': ('..##', '...#', '...#', '...#', '#..#', '.##.'),
+    'K': ('#..#', '#.#.', '##..', '#.#.', '#.#.', '#..#'),
+    'L': ('#...', '#...', '#...', '#...', '#...', '####'),
+    'O': ('.##.', '#..#', '#..#', '#..#', '#..#', '.##.'),
+    'P': ('###.', '#..#', '#..#', '###.', '#...', '#...'),
+    'R': ('###.', '#..#', '#..#', '###.', '#.#.', '#..#'),
+    'S': ('.###', '#...', '#...', '.##.', '...#', '###.'),
+    'U': ('#..#', '#..#', '#..#', '#..#', '#..#', '.##.'),
+    'Z': ('####', '...#', '..#.', '.#..', '#...', '####'),
+}
+GLYPHS = {
+    glyph: letter
+    for letter, glyph in _GLYPHS.items()
+}
+UNKNOWN_LETTER = '?'
+
+
+def read_code(rows: List[str]) -> str:
+    """Read the letters drawn by the folded paper, unknown ones are `UNKNOWN_LETTER`"""
+    if len(rows) != GLYPH_HEIGHT:
+        raise ValueError(f'Letters are {GLYPH_HEIGHT} rows high, got {len(rows)} rows')
+    width = max(map(len, rows), default=0)
+    return ''.join(
+        GLYPHS.get(tuple(row[x:x + GLYPH_WIDTH - 1].ljust(GLYPH_WIDTH - 1, '.') for row in rows), UNKNOWN_LETTER)
+        for x in range(0, width, GLYPH_WIDTH)
+    )
+
+
 @dataclasses.dataclass
 class Paper:
     width: int = dataclasses.field(default=0)
@@ -60,16 +117,7 @@ class Paper:
         return new_paper
 
     def content(self) -> List[str]:
-        rv = []
-        for y in range(self.height):
-            row = ''
-            for x in range(self.width):
-                if Point(x, y) in self.dots:
-                    row += '#'
-                else:
-                    row += '.'
-            rv.append(row)
-        return rv
+        return render(self.width, self.height, (p.x for p in self.dots), (p.y for p in self.dots))
 
     def to_file(self, filename: str):
         with open(filename, 'w') as f:
@@ -110,6 +158,264 @@ class Instruction:
             return cls(Direction.Left, int(line))
 
 
+@dataclasses.dataclass
+class BitPaper:
+    """Same as `Paper` where each row is an int with bit x set when there is a dot at x. Folds happen in place."""
+    width: int = dataclasses.field(default=0)
+    height: int = dataclasses.field(default=0)
+    rows: List[int] = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def from_paper(cls, paper: Paper) -> "BitPaper":
+        rv = cls(paper.width, paper.height, [0] * paper.height)
+        for p in paper.dots:
+            rv.rows[p.y] |= 1 << p.x
+        return rv
+
+    def __len__(self):
+        return sum((
+            bin(r).count('1')
+            for r in self.rows
+        ))
+
+    def add(self, point: Point):
+        self.width = max(self.width, point.x + 1)
+        if point.y >= self.height:
+            self.rows.extend([0] * (point.y + 1 - self.height))
+            self.height = point.y + 1
+        self.rows[point.y] |= 1 << point.x
+
+    def fold_up(self, y: int) -> "BitPaper":
+        if y < self.height and self.rows[y]:
+            raise RuntimeError(f'There should be no dots on line y={y}')
+
+        # the mirror position is the same as in `Paper.fold_up`
+        mirrored = [
+            (self.height - py - (self.height % 2), self.rows[py])
+            for py in range(y + 1, self.height)
+            if self.rows[py]
+        ]
+        del self.rows[y:]
+        kept = max((ky + 1 for ky, row in enumerate(self.rows) if row), default=0)
+        height = max([self.height // 2, kept] + [ny + 1 for ny, _ in mirrored])
+        self.rows.extend([0] * (height - len(self.rows)))
+        for ny, row in mirrored:
+            self.rows[ny] |= row
+        del self.rows[height:]
+        self.height = height
+        return self
+
+    def fold_left(self, x: int) -> "BitPaper":
+        # the mirror position is the same as in `Paper.fold_left`: bit x + 1 + k goes to bit `last - k`
+        last = self.width - (self.width % 2) - x - 1
+        keep = (1 << x) - 1
+        width = self.width // 2
+        if any((row >> x) & 1 for row in self.rows):
+            raise RuntimeError(f'There should be no dots on line x={x}')
+        for y, row in enumerate(self.rows):
+            folded = row >> (x + 1)
+            row &= keep
+            if folded:
+                row |= int(format(folded, f'0{last + 1}b')[::-1], 2)
+            self.rows[y] = row
+            width = max(width, row.bit_length())
+        self.width = width
+        return self
+
+    def content(self) -> List[str]:
+        return [
+            format(r, f'0{self.width}b')[::-1].replace('0', '.').replace('1', '#')
+            for r in self.rows
+        ]
+
+    def to_file(self, filename: str):
+        with open(filename, 'w') as f:
+            rows = self.content()
+            for row in rows:
+                f.write(row + '\n')
+            print(f'{len(rows)} rows written to {filename}')
+
+    def perform(self, instructions: List["Instruction"]) -> "BitPaper":
+        for i in instructions:
+            if i.direction == Direction.Up:
+                self.fold_up(i.value)
+            elif i.direction == Direction.Left:
+                self.fold_left(i.value)
+            else:
+                raise ValueError(f'Unexpected direction={i.direction}')
+        return self
+
+
+@dataclasses.dataclass
+class FoldMap:
+    """
+    All the folds composed into one lookup per axis: dot (x, y) ends up at (xs[x], ys[y]).
+
+    A fold is a reflection so the composition does not depend on the dots as long as every fold halves the paper,
+    which is the case when folding on the middle line. A coordinate mapped to -1 was on a fold line at some point.
+    """
+    width: int  # size of the paper once folded
+    height: int
+    xs: array = dataclasses.field(repr=False)
+    ys: array = dataclasses.field(repr=False)
+
+    @staticmethod
+    def _fold_axis(lookup: array, size: int, value: int) -> int:
+        """Fold every coordinate of the lookup on `value`, return the new size"""
+        if value != size // 2:
+            raise ValueError(f'Can only compose folds on the middle line, {value} is not the middle of {size}')
+        for i, c in enumerate(lookup):
+            if c > value:
+                # the mirror position is the same as in `Paper.fold_up` and `Paper.fold_left`
+                lookup[i] = size - c - (size % 2)
+            elif c == value:
+                lookup[i] = -1
+        return size // 2
+
+    @classmethod
+    def compose(cls, width: int, height: int, instructions: List["Instruction"]) -> "FoldMap":
+        xs = array('l', range(width))
+        ys = array('l', range(height))
+        for i in instructions:
+            if i.direction == Direction.Up:
+                height = cls._fold_axis(ys, height, i.value)
+            elif i.direction == Direction.Left:
+                width = cls._fold_axis(xs, width, i.value)
+            else:
+                raise ValueError(f'Unexpected direction={i.direction}')
+        return cls(width, height, xs, ys)
+
+    def fold(self, point: Point) -> Point:
+        x, y = self.xs[point.x], self.ys[point.y]
+        if x < 0 or y < 0:
+            raise RuntimeError(f'{point} is on a fold line')
+        return Point(x, y)
+
+    def apply(self, points: Iterable[Point]) -> Paper:
+        rv = Paper(self.width, self.height)
+        for p in points:
+            rv.dots.add(self.fold(p))
+        return rv
+
+
+@dataclasses.dataclass
+class ArrayPaper:
+    """
+    Same as `Paper` with the dots as two coordinate arrays: dot i is at (xs[i], ys[i]).
+
+    A fold maps the whole array through a lookup table and dots that land on the same spot are kept as duplicates,
+    they are only removed when counting.
+    """
+    width: int = dataclasses.field(default=0)
+    height: int = dataclasses.field(default=0)
+    xs: array = dataclasses.field(default_factory=lambda: array('l'), repr=False)
+    ys: array = dataclasses.field(default_factory=lambda: array('l'), repr=False)
+
+    @classmethod
+    def from_paper(cls, paper: Paper) -> "ArrayPaper":
+        return cls(
+            paper.width,
+            paper.height,
+            array('l', (p.x for p in paper.dots)),
+            array('l', (p.y for p in paper.dots)),
+        )
+
+    def __len__(self):
+        # pack (x, y) in a single int to remove duplicates
+        return len(set(map(add, map(self.width.__mul__, self.ys), self.xs)))
+
+    def add(self, point: Point):
+        self.width = max(self.width, point.x + 1)
+        self.height = max(self.height, point.y + 1)
+        self.xs.append(point.x)
+        self.ys.append(point.y)
+
+    @staticmethod
+    def _fold_axis(coordinates: array, size: int, value: int) -> Tuple[array, int]:
+        """Fold the coordinates on `value`, return them with the new size"""
+        if value in coordinates:
+            raise RuntimeError(f'There should be no dots on line {value}')
+        # the mirror position is the same as in `Paper.fold_up` and `Paper.fold_left`
+        lookup = list(range(value)) + [-1] + [size - c - (size % 2) for c in range(value + 1, size)]
+        folded = array('l', map(lookup.__getitem__, coordinates))
+        return folded, max(size // 2, max(folded, default=-1) + 1)
+
+    def fold_up(self, y: int) -> "ArrayPaper":
+        ys, height = self._fold_axis(self.ys, self.height, y)
+        return ArrayPaper(self.width, height, self.xs, ys)
+
+    def fold_left(self, x: int) -> "ArrayPaper":
+        xs, width = self._fold_axis(self.xs, self.width, x)
+        return ArrayPaper(width, self.height, xs, self.ys)
+
+    def content(self) -> List[str]:
+        return render(self.width, self.height, self.xs, self.ys)
+
+    def to_paper(self) -> Paper:
+        return Paper(self.width, self.height, set(map(Point, self.xs, self.ys)))
+
+    def to_file(self, filename: str):
+        self.to_paper().to_file(filename)
+
+    def perform(self, instructions: List["Instruction"]) -> "ArrayPaper":
+        current = self
+        for i in instructions:
+            if i.direction == Direction.Up:
+                current = current.fold_up(i.value)
+            elif i.direction == Direction.Left:
+                current = current.fold_left(i.value)
+            else:
+                raise ValueError(f'Unexpected direction={i.direction}')
+        return current
+
+
+def random_paper(width: int, height: int, instructions: List["Instruction"], count: int, seed: int = 0) -> Paper:
+    """A paper with up to `count` random dots that can be folded by `instructions`, fewer when some are drawn twice"""
+    fold_map = FoldMap.compose(width, height, instructions)
+    xs = [x for x in range(width) if fold_map.xs[x] >= 0]
+    ys = [y for y in range(height) if fold_map.ys[y] >= 0]
+    rng = random.Random(seed)
+    rv = Paper(width, height)
+    for _ in range(count):
+        rv.add(Point(rng.choice(xs), rng.choice(ys)))
+    return rv
+
+
+def _read_dots(f) -> Iterable[Point]:
+    """Read points until the first blank line"""
+    for line in f:
+        line = line.replace('\n', '')
+        if not line:
+            return
+        yield Point.from_str(line)
+
+
+def load_folded(filename: str, max_fold: Optional[int] = None) -> Tuple[Paper, List[Instruction]]:
+    """
+    Same result as `load_data` followed by `Paper.perform` but without keeping the unfolded dots:
+    the first pass over the file finds the size of the paper and the instructions, the second one folds every dot once.
+    """
+    width, height = 0, 0
+    with open(filename, 'r') as f:
+        for p in _read_dots(f):
+            width = max(width, p.x + 1)
+            height = max(height, p.y + 1)
+        instructions = [
+            Instruction.from_str(line.replace('\n', ''))
+            for line in f
+            if line.strip()
+        ]
+    if max_fold is not None:
+        instructions = instructions[:max_fold]
+
+    fold_map = FoldMap.compose(width, height, instructions)
+    with open(filename, 'r') as f:
+        paper = fold_map.apply(_read_dots(f))
+
+    print(f'Folded a {width}x{height} grid {len(instructions)} times into {len(paper.dots)} dots from {filename}')
+    return paper, instructions
+
+
 def load_data(filename: str) -> Tuple[Paper, List[Instruction]]:
     with open(filename, 'r') as f:
         load_points = True  # changes to False on first blank line
@@ -138,16 +444,40 @@ if __name__ == '__main__':
     parser.add_argument('--output', type=str, default=None, help='Output file with all paths')
     parser.add_argument('--max-fold', type=int, default=None,
                         help='Maximum number of instructions to perform, for q1 say 1, default=%(default)s.')
+    parser.add_argument('--engine', type=str, choices=('set', 'bits', 'stream', 'arrays'), default='set',
+                        help='Fold a set of dots (set), rows of bits in place (bits), '
+                             'stream the dots through the composed folds (stream) '
+                             'or fold arrays of coordinates (arrays), default=%(default)s.')
+    parser.add_argument('--benchmark', type=int, default=None,
+                        help='Time the set and arrays engines on this many random dots folded by the input instructions.')
     args = parser.parse_args()
 
-    paper, instructions = load_data(args.input)
+    if args.benchmark is not None:
+        paper, instructions = load_data(args.input)
+        paper = random_paper(paper.width, paper.height, instructions[:args.max_fold], args.benchmark)
+        print(f'Generated {len(paper)} random dots')
+        for engine, start_paper in (('set', paper), ('arrays', ArrayPaper.from_paper(paper))):
+            start = time()
+            first = start_paper.perform(instructions[:args.max_fold])
+            print(f'{engine}: {len(first)} dots after folding in {time() - start:.2f} sec')
+    else:
+        if args.engine == 'stream':
+            first, instructions = load_folded(args.input, args.max_fold)
+        else:
+            paper, instructions = load_data(args.input)
+            if args.engine == 'bits':
+                paper = BitPaper.from_paper(paper)
+            elif args.engine == 'arrays':
+                paper = ArrayPaper.from_paper(paper)
 
-    if args.max_fold is not None:
-        instructions = instructions[:args.max_fold]
-        print(f'Limiting to {len(instructions)} folds')
+            if args.max_fold is not None:
+                instructions = instructions[:args.max_fold]
+                print(f'Limiting to {len(instructions)} folds')
 
-    first = paper.perform(instructions)
-    print(f'There are {len(first.dots)} dots visible after folding {len(instructions)} times')
+            first = paper.perform(instructions)
+        print(f'There are {len(first)} dots visible after folding {len(instructions)} times')
+        if first.height == GLYPH_HEIGHT:
+            print(f'The code is {read_code(first.content())}')
 
-    if args.output:
-        first.to_file(args.output)
+        if args.output:
+            first.to_file(args.output)
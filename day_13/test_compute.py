@@ -1,6 +1,22 @@
+import runpy
+import sys
+
 import pytest
 
-from day_13.compute import Point, Paper, Instruction, Direction, load_data
+from day_13.compute import (
+    Point,
+    Paper,
+    BitPaper,
+    FoldMap,
+    ArrayPaper,
+    Instruction,
+    Direction,
+    load_data,
+    load_folded,
+    random_paper,
+    render,
+    read_code,
+)
 
 
 @pytest.fixture
@@ -89,6 +105,143 @@ class TestPaper:
         assert actual.content() == expected
 
 
+class TestBitPaper:
+    def test_content(self, example):
+        bits = BitPaper.from_paper(example)
+        assert len(bits) == len(example)
+        assert bits.content() == example.content()
+
+    def test_fold_up(self, example):
+        bits = BitPaper.from_paper(example)
+        assert bits.fold_up(7) is bits
+        assert bits.content() == example.fold_up(7).content()
+        assert len(bits) == 17
+
+    def test_fold_left(self, example):
+        bits = BitPaper.from_paper(example).fold_up(7).fold_left(5)
+        expected = example.fold_up(7).fold_left(5)
+        assert (bits.width, bits.height) == (expected.width, expected.height)
+        assert bits.content() == expected.content()
+        assert len(bits) == 16
+
+    @pytest.mark.parametrize('instruction', (
+        Instruction(Direction.Up, 2),
+        Instruction(Direction.Up, 9),
+        Instruction(Direction.Left, 7),
+    ))
+    def test_uneven_folds(self, example, instruction):
+        # folds away from the middle move dots the same way as `Paper`
+        expected = example.perform([instruction])
+        actual = BitPaper.from_paper(example).perform([instruction])
+        assert (actual.width, actual.height) == (expected.width, expected.height)
+        assert actual.content() == expected.content()
+
+    def test_dot_on_fold(self, example):
+        with pytest.raises(RuntimeError):
+            BitPaper.from_paper(example).fold_up(10)
+        with pytest.raises(RuntimeError):
+            BitPaper.from_paper(example).fold_left(6)
+
+    def test_add(self):
+        bits = BitPaper()
+        bits.add(Point(3, 2))
+        assert (bits.width, bits.height) == (4, 3)
+        assert bits.content() == ['....', '....', '...#']
+
+    def test_q2(self):
+        paper, instructions = load_data('input.txt')
+        assert BitPaper.from_paper(paper).perform(instructions).content() == paper.perform(instructions).content()
+
+    def test_to_file(self, example, tmp_path):
+        filename = tmp_path / 'bits.txt'
+        BitPaper.from_paper(example).to_file(str(filename))
+        assert filename.read_text().splitlines() == example.content()
+
+
+class TestFoldMap:
+    def test_compose(self):
+        fold_map = FoldMap.compose(11, 15, [Instruction(Direction.Up, 7), Instruction(Direction.Left, 5)])
+        assert (fold_map.width, fold_map.height) == (5, 7)
+        assert list(fold_map.xs) == [0, 1, 2, 3, 4, -1, 4, 3, 2, 1, 0]
+        assert list(fold_map.ys) == [0, 1, 2, 3, 4, 5, 6, -1, 6, 5, 4, 3, 2, 1, 0]
+
+    def test_apply(self, example):
+        instructions = [Instruction(Direction.Up, 7), Instruction(Direction.Left, 5)]
+        actual = FoldMap.compose(example.width, example.height, instructions).apply(example.dots)
+        assert actual == example.perform(instructions)
+
+    def test_not_middle(self):
+        with pytest.raises(ValueError):
+            FoldMap.compose(11, 15, [Instruction(Direction.Up, 9)])
+
+    def test_dot_on_fold(self):
+        fold_map = FoldMap.compose(11, 15, [Instruction(Direction.Up, 7), Instruction(Direction.Left, 5)])
+        with pytest.raises(RuntimeError):
+            fold_map.fold(Point(5, 2))
+
+    @pytest.mark.parametrize('max_fold', (1, None))
+    def test_load_folded(self, max_fold):
+        paper, instructions = load_data('input.txt')
+        expected = paper.perform(instructions[:max_fold])
+        actual, _ = load_folded('input.txt', max_fold)
+        assert actual == expected
+
+
+class TestArrayPaper:
+    def test_content(self, example):
+        assert ArrayPaper.from_paper(example).content() == example.content()
+
+    @pytest.mark.parametrize('instructions', (
+        [Instruction(Direction.Up, 7)],
+        [Instruction(Direction.Up, 7), Instruction(Direction.Left, 5)],
+        [Instruction(Direction.Up, 2)],
+        [Instruction(Direction.Up, 9)],
+        [Instruction(Direction.Left, 7)],
+    ))
+    def test_perform(self, example, instructions):
+        expected = example.perform(instructions)
+        actual = ArrayPaper.from_paper(example).perform(instructions)
+        assert len(actual) == len(expected)
+        assert actual.content() == expected.content()
+        assert actual.to_paper() == expected
+
+    def test_dot_on_fold(self, example):
+        with pytest.raises(RuntimeError):
+            ArrayPaper.from_paper(example).fold_up(10)
+        with pytest.raises(RuntimeError):
+            ArrayPaper.from_paper(example).fold_left(6)
+
+    def test_random_paper(self):
+        paper, instructions = load_data('input.txt')
+        noisy = random_paper(paper.width, paper.height, instructions, 5000)
+        assert ArrayPaper.from_paper(noisy).perform(instructions).to_paper() == noisy.perform(instructions)
+
+
+def test_render():
+    assert render(3, 2, [0, 2, 2], [1, 0, 0]) == ['..#', '#..']
+
+
+class TestReadCode:
+    def test_q2(self):
+        paper, instructions = load_data('input.txt')
+        assert read_code(paper.perform(instructions).content()) == 'CEJKLUGJ'
+
+    def test_unknown_letter(self):
+        rows = [
+            '#..#.####.#...',
+            '#..#.#....#...',
+            '####.###..#...',
+            '#..#.#....#...',
+            '#..#.#....#...',
+            '#..#.####.###.',
+        ]
+        assert read_code(rows) == 'HE?'
+
+    def test_wrong_height(self, example):
+        with pytest.raises(ValueError):
+            read_code(example.content())
+
+
 class TestInstruction:
     @pytest.mark.parametrize('value, expected', (
         ('fold along y=7', Instruction(Direction.Up, 7)),
@@ -98,6 +251,23 @@ class TestInstruction:
         assert Instruction.from_str(value) == expected
 
 
+@pytest.mark.parametrize('engine', ('set', 'bits', 'stream', 'arrays'))
+def test_main_output(engine, tmp_path, monkeypatch):
+    filename = tmp_path / 'output.txt'
+    monkeypatch.setattr(sys, 'argv', ['compute.py', '--engine', engine, '--output', str(filename)])
+    runpy.run_path('compute.py', run_name='__main__')
+    paper, instructions = load_data('input.txt')
+    assert filename.read_text().splitlines() == paper.perform(instructions).content()
+
+
+def test_main_benchmark(tmp_path, monkeypatch, capsys):
+    filename = tmp_path / 'output.txt'
+    monkeypatch.setattr(sys, 'argv', ['compute.py', '--benchmark', '100', '--output', str(filename)])
+    runpy.run_path('compute.py', run_name='__main__')
+    assert 'The code is' not in capsys.readouterr().out
+    assert not filename.exists()
+
+
 def test_q1_example():
     paper, instructions = load_data('example.txt')
     actual = paper.perform(instructions[:1])
@@ -1,9 +1,12 @@
 import dataclasses
 import re
 from argparse import ArgumentParser
-from operator import itemgetter
+from functools import cmp_to_key
+from array import array
+from decimal import Decimal, Context, localcontext, MAX_EMAX, MIN_EMIN
+from operator import itemgetter, mul
 from time import time
-from typing import List, Dict, Tuple, Iterator, Union, Set
+from typing import List, Dict, Tuple, Iterator, Union, Set, Optional, Sequence
 
 
 @dataclasses.dataclass(frozen=True)
@@ -29,6 +32,181 @@ class Rule:
         ]
 
 
+Matrix = List[List[int]]
+
+
+def _mat_mul(a: Matrix, b: Matrix, modulus: Optional[int] = None) -> Matrix:
+    columns = list(zip(*b))
+    if modulus is None:
+        return [[sum(map(mul, row, col)) for col in columns] for row in a]
+    return [[sum(map(mul, row, col)) % modulus for col in columns] for row in a]
+
+
+def _vec_mul(v: List[int], m: Matrix, modulus: Optional[int] = None) -> List[int]:
+    return _mat_mul([v], m, modulus)[0]
+
+
+def vec_mat_pow(v: List[int], m: Matrix, power: int, modulus: Optional[int] = None) -> List[int]:
+    """`v * m ** power` by repeated squaring of `m`"""
+    while power:
+        if power & 1:
+            v = _vec_mul(v, m, modulus)
+        power >>= 1
+        if power:
+            m = _mat_mul(m, m, modulus)
+    return v
+
+
+# no overflow nor underflow: a count rounded to `prec` digits is never 0
+_RANK_CONTEXT = Context(prec=40, Emax=MAX_EMAX, Emin=MIN_EMIN)
+
+
+def vec_mat_pow_decimal(v: List[int], m: Matrix, power: int) -> List[Decimal]:
+    """Same as `vec_mat_pow` rounded to the precision of `_RANK_CONTEXT`, to rank counts that are too big for ints"""
+    with localcontext(_RANK_CONTEXT):
+        return vec_mat_pow(list(map(Decimal, v)), [list(map(Decimal, row)) for row in m], power)
+
+
+def vec_mat_pow_support(v: List[int], m: Matrix, power: int) -> List[int]:
+    """1 where `v * m ** power` is not 0, else 0: same as `vec_mat_pow` with every value capped to 1"""
+    v = [min(c, 1) for c in v]
+    m = [[min(c, 1) for c in row] for row in m]
+    while power:
+        if power & 1:
+            v = [min(c, 1) for c in _vec_mul(v, m)]
+        power >>= 1
+        if power:
+            m = [[min(c, 1) for c in row] for row in _mat_mul(m, m)]
+    return v
+
+
+@dataclasses.dataclass
+class PairSpace:
+    """Number every element in `[0, K)` and the pair `ab` as `a * K + b`"""
+    elements: List[str]
+    index: Dict[str, int] = dataclasses.field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.index = {e: i for i, e in enumerate(self.elements)}
+
+    def __len__(self):
+        return len(self.elements) ** 2
+
+    @classmethod
+    def from_bench(cls, bench: "Bench") -> "PairSpace":
+        elements = set(bench.polymer)
+        for rule in bench.rules.values():
+            elements.update(rule.input)
+            elements.update(rule.output)
+        return cls(sorted(elements))
+
+    def pair_index(self, pair: str) -> int:
+        return self.index[pair[0]] * len(self.elements) + self.index[pair[1]]
+
+    def pair(self, index: int) -> str:
+        first, second = divmod(index, len(self.elements))
+        return self.elements[first] + self.elements[second]
+
+    def pair_counts(self, polymer: str) -> List[int]:
+        rv = [0] * len(self)
+        for pair in Bench.pairs(polymer):
+            rv[self.pair_index(pair)] += 1
+        return rv
+
+    def transition_matrix(self, rules: Dict[str, Rule]) -> Matrix:
+        """`m[i][j]` is how many pairs `j` the pair `i` becomes after one step, a pair without rule stays as it is"""
+        rv = [[0] * len(self) for _ in range(len(self))]
+        for i in range(len(self)):
+            rule = rules.get(self.pair(i))
+            if rule is None:
+                rv[i][i] += 1
+            else:
+                for new_pair in rule.output_pairs():
+                    rv[i][self.pair_index(new_pair)] += 1
+        return rv
+
+    def reachable(self, pair_counts: List[int], transition: Matrix) -> List[int]:
+        """Sorted indexes of the pairs that are in `pair_counts` or that they can become"""
+        seen = {i for i, c in enumerate(pair_counts) if c}
+        to_visit = list(seen)
+        while to_visit:
+            i = to_visit.pop()
+            for j, c in enumerate(transition[i]):
+                if c and j not in seen:
+                    seen.add(j)
+                    to_visit.append(j)
+        return sorted(seen)
+
+    def expand(self, pairs: List[int], values: List) -> List:
+        """Counts of every pair of the space from `values` of the `pairs` only"""
+        rv = [0] * len(self)
+        for i, v in zip(pairs, values):
+            rv[i] = v
+        return rv
+
+    def element_counts(self, pair_counts: List) -> List:
+        """Count the first element of every pair, the caller has to add the last element of the polymer"""
+        size = len(self.elements)
+        return [
+            sum(pair_counts[e * size:(e + 1) * size])
+            for e in range(size)
+        ]
+
+
+NO_PAIR = -1
+# relative difference under which two decimal ranks are considered equal
+RANK_TOLERANCE = Decimal('1e-30')
+# up to this number of turns elements are ranked with their exact count instead of decimals
+EXACT_RANK_TURNS = 10_000
+
+
+@dataclasses.dataclass
+class CompiledRules:
+    """
+    Rules as two arrays of pair indexes in a `PairSpace`: the pair `i` becomes the pairs `first[i]` and `second[i]`.
+    A pair without rule stays as it is, so `first[i] == i` and `second[i] == NO_PAIR`.
+    """
+    space: PairSpace
+    first: array = dataclasses.field(repr=False)
+    second: array = dataclasses.field(repr=False)
+
+    @classmethod
+    def compile(cls, bench: "Bench") -> "CompiledRules":
+        space = PairSpace.from_bench(bench)
+        first = array('l', range(len(space)))
+        second = array('l', [NO_PAIR] * len(space))
+        for rule in bench.rules.values():
+            i = space.pair_index(rule.input)
+            first[i], second[i] = map(space.pair_index, rule.output_pairs())
+        return cls(space, first, second)
+
+    def pair_counts(self, polymer: str) -> array:
+        return array('Q', self.space.pair_counts(polymer))
+
+    def step(self, counts: Sequence[int]) -> Sequence[int]:
+        """Scatter the count of every pair to the pairs it becomes, keeps the type of `counts`"""
+        if isinstance(counts, array):
+            rv = array(counts.typecode, bytes(counts.itemsize * len(counts)))
+        else:
+            rv = [0] * len(counts)
+        first, second = self.first, self.second
+        for i, count in enumerate(counts):
+            if count:
+                rv[first[i]] += count
+                if second[i] != NO_PAIR:
+                    rv[second[i]] += count
+        return rv
+
+    def simulate(self, counts: Sequence[int], turns: int) -> Sequence[int]:
+        for t in range(1, turns + 1):
+            try:
+                counts = self.step(counts)
+            except OverflowError:
+                # counts do not fit in 64 bits anymore, carry on with python ints
+                counts = self.step(list(counts))
+        return counts
+
+
 @dataclasses.dataclass
 class Bench:
     # initial polymer
@@ -37,6 +215,9 @@ class Bench:
 
     # map character -> number of entries
     _polymer_map: Dict[str, int] = dataclasses.field(default_factory=dict)
+    # when set `_polymer_map` is modulo this number and elements are ranked with `_polymer_rank` instead
+    _modulus: Optional[int] = dataclasses.field(default=None)
+    _polymer_rank: Dict[str, Union[int, Decimal]] = dataclasses.field(default_factory=dict)
 
     def __post_init__(self):
         self._update_map()
@@ -49,6 +230,7 @@ class Bench:
 
     def _update_map(self):
         start = time()
+        self._reset_modulus()
         self._polymer_map.clear()
         for l in self.polymer:
             if l not in self._polymer_map:
@@ -56,6 +238,10 @@ class Bench:
             self._polymer_map[l] += 1
         return time() - start
 
+    def _reset_modulus(self):
+        self._modulus = None
+        self._polymer_rank.clear()
+
     def _add_rule(self, rule: Rule):
         self.rules[rule.input] = rule
 
@@ -84,10 +270,54 @@ class Bench:
     #
     #     return ''.join(start_polymer), ''.join(self.polymer)
 
+    def _compare_modulo(self, a: Tuple[str, int], b: Tuple[str, int]) -> int:
+        """
+        Order two (element, count modulo `_modulus`) with their rank, their exact count or a rounded decimal.
+        Close decimal ranks are too imprecise to be used: the difference of the counts modulo `_modulus` is then used
+        when it is sure to be below half of it, otherwise the order is unknown.
+        """
+        rank_a, rank_b = self._polymer_rank[a[0]], self._polymer_rank[b[0]]
+        if not isinstance(rank_a, Decimal):
+            return rank_a - rank_b
+        with localcontext(_RANK_CONTEXT):
+            top = max(rank_a, rank_b)
+            if abs(rank_a - rank_b) > RANK_TOLERANCE * top:
+                return 1 if rank_a > rank_b else -1
+            if 2 * RANK_TOLERANCE * top >= self._modulus // 2:
+                raise ValueError(f'Cannot rank {a[0]} and {b[0]} modulo {self._modulus}, their counts are too close')
+        difference = (a[1] - b[1]) % self._modulus
+        if difference > self._modulus // 2:
+            difference -= self._modulus
+        return difference
+
+    def _close_ranks(self, a: str, b: str) -> bool:
+        rank_a, rank_b = self._polymer_rank[a], self._polymer_rank[b]
+        if not isinstance(rank_a, Decimal):
+            return rank_a == rank_b
+        with localcontext(_RANK_CONTEXT):
+            return abs(rank_a - rank_b) <= RANK_TOLERANCE * max(rank_a, rank_b)
+
+    def _modulo_extremes(self) -> List[Tuple[str, int]]:
+        """
+        The least and most common (element, count modulo `_modulus`): only the elements with a rank close to them
+        need `_compare_modulo`, elements in the middle can be too close to be ordered.
+        """
+        ranked = sorted(self._polymer_map.items(), key=lambda item: self._polymer_rank[item[0]])
+        key = cmp_to_key(self._compare_modulo)
+        return [
+            min((item for item in ranked if self._close_ranks(item[0], ranked[0][0])), key=key),
+            max((item for item in ranked if self._close_ranks(item[0], ranked[-1][0])), key=key),
+        ]
+
     def score(self) -> int:
-        sorted_elems = sorted(self._polymer_map.items(), key=itemgetter(1))  # type: List[Tuple[str, int]]
+        if self._modulus is None:
+            sorted_elems = sorted(self._polymer_map.items(), key=itemgetter(1))  # type: List[Tuple[str, int]]
+        else:
+            sorted_elems = self._modulo_extremes()
         print(f'Most common element: {sorted_elems[-1]}, least common element: {sorted_elems[0]}')
-        return sorted_elems[-1][1] - sorted_elems[0][1]
+        if self._modulus is None:
+            return sorted_elems[-1][1] - sorted_elems[0][1]
+        return (sorted_elems[-1][1] - sorted_elems[0][1]) % self._modulus
 
     @classmethod
     def from_file(cls, filename: str) -> "Bench":
@@ -154,50 +384,101 @@ class Bench:
         """This is fast but only computes the polymer map"""
         # To do a long simulation and only get the score, since it's too long to get the actual polymer
         start = time()
-        # Map Pair -> number of time it's present
-        pair_map: Dict[str, int] = {}
-        for pair in self.pairs(self.polymer):
-            if pair not in pair_map:
-                pair_map[pair] = 0
-            pair_map[pair] += 1
+        rules = CompiledRules.compile(self)
+        counts = rules.simulate(rules.pair_counts(self.polymer), turns)
         # last character to not forget it when we will compute _polymer_map
-        left_over = self.polymer[-1]  # single character
-
-        for t in range(1, turns + 1):
-            new_pair_map = {}
-            for pair, count in pair_map.items():
-                rule = self.rules.get(pair)
-                if rule is not None:
-                    for new_pair in rule.output_pairs():
-                        if new_pair not in new_pair_map:
-                            new_pair_map[new_pair] = 0
-                        new_pair_map[new_pair] += count
-                else:
-                    new_pair_map[pair] = count  # unknown rule
-            pair_map = new_pair_map
+        element_counts = rules.space.element_counts(counts)
+        element_counts[rules.space.index[self.polymer[-1]]] += 1
 
         # and now update the polymer map
+        self._reset_modulus()
         self._polymer_map.clear()
-        for pair, count in pair_map.items():
-            l = pair[0]  # take the first letter only
-            if l not in self._polymer_map:
-                self._polymer_map[l] = 0
-            self._polymer_map[l] += count
-        if left_over not in self._polymer_map:
-            self._polymer_map[left_over] = 0
-        self._polymer_map[left_over] += 1
+        self._polymer_map.update(
+            (element, count)
+            for element, count in zip(rules.space.elements, element_counts)
+            if count
+        )
+
+        return time() - start
+
+    def matrix_simulate(self, turns: int = 40, modulus: Optional[int] = None) -> float:
+        """
+        Same result as `fast_simulate` in O(log(turns)) matrix products, only computes the polymer map.
+        With a `modulus` the counts are kept modulo it and the elements are ranked with their exact count,
+        or with rounded decimals after `EXACT_RANK_TURNS` turns.
+        """
+        start = time()
+        space = PairSpace.from_bench(self)
+        transition = space.transition_matrix(self.rules)
+        pair_counts = space.pair_counts(self.polymer)
+        last = space.index[self.polymer[-1]]
+
+        # only keep the pairs the polymer can have, to multiply smaller matrices
+        pairs = space.reachable(pair_counts, transition)
+        transition = [[transition[i][j] for j in pairs] for i in pairs]
+        reachable_counts = [pair_counts[i] for i in pairs]
+
+        counts = space.element_counts(space.expand(pairs, vec_mat_pow(reachable_counts, transition, turns, modulus)))
+        counts[last] += 1
+
+        self._reset_modulus()
+        self._polymer_map.clear()
+        if modulus is None:
+            present = [c > 0 for c in counts]
+        elif turns <= EXACT_RANK_TURNS:
+            rules = CompiledRules.compile(self)
+            exact = space.element_counts(rules.simulate(list(pair_counts), turns))
+            exact[last] += 1
+            present = [c > 0 for c in exact]
+            self._modulus = modulus
+            self._polymer_rank.update(
+                (element, exact[e])
+                for e, element in enumerate(space.elements)
+                if present[e]
+            )
+        else:
+            support = vec_mat_pow_support(reachable_counts, transition, turns)
+            support = space.element_counts(space.expand(pairs, support))
+            present = [c > 0 or e == last for e, c in enumerate(support)]
+            with localcontext(_RANK_CONTEXT):
+                rank = vec_mat_pow_decimal(reachable_counts, transition, turns)
+                rank = space.element_counts(space.expand(pairs, rank))
+                rank[last] += 1
+            self._modulus = modulus
+            self._polymer_rank.update(
+                (element, rank[e])
+                for e, element in enumerate(space.elements)
+                if present[e]
+            )
+        self._polymer_map.update(
+            (element, counts[e] % modulus if modulus else counts[e])
+            for e, element in enumerate(space.elements)
+            if present[e]
+        )
 
         return time() - start
 
 
+def parse_steps(value: str) -> int:
+    """Number of steps as an int or a power like `10**9`"""
+    if '**' in value:
+        base, exponent = value.split('**')
+        return int(base) ** int(exponent)
+    return int(value)
+
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--input', type=str, default='input.txt', help='Input file')
-    parser.add_argument('--steps', type=int, default=10,
-                        help='Number of steps to simulate, default=%(default)s. Use 10 for Q1 and 40 for Q2')
+    parser.add_argument('--steps', type=parse_steps, default=10,
+                        help='Number of steps to simulate, can be a power like 10**9, default=%(default)s. '
+                             'Use 10 for Q1 and 40 for Q2')
     parser.add_argument('--slow', action='store_true',
                         help='Compute the result polymer, this is slow and should not be used for steps > 15')
+    parser.add_argument('--matrix', action='store_true',
+                        help='Raise the pair transition matrix to the number of steps, use for a very large --steps')
+    parser.add_argument('--modulus', type=int, default=None,
+                        help='Only with --matrix: report counts and score modulo this number, default=%(default)s.')
     args = parser.parse_args()
 
     bench = Bench.from_file(args.input)
@@ -208,6 +489,13 @@ if __name__ == '__main__':
         bench.simulate_reaction(args.steps)
         print(f'Simulating {args.steps} steps took {time() - start:.2f} seconds')
         print(f'Result poly is {len(bench.polymer)} long')
+    elif args.matrix:
+        print('Doing a matrix simulation' + (f' modulo {args.modulus}' if args.modulus else ''))
+        duration = bench.matrix_simulate(args.steps, args.modulus)
+        print(
+            f'Compute the polymer map for {args.steps} steps took {duration:.2f} seconds. '
+            'The result polymer is unknown.'
+        )
     else:
         print('Doing a fast simulation')
         duration = bench.fast_simulate(args.steps)
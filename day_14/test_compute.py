@@ -1,8 +1,11 @@
+import random
 from time import time
+from typing import Tuple
 
 import pytest
 
-from day_14.compute import Bench, Rule
+from day_14 import compute
+from day_14.compute import Bench, Rule, PairSpace, CompiledRules, NO_PAIR, parse_steps
 
 
 class TestRule:
@@ -15,6 +18,51 @@ class TestRule:
         assert Rule.from_str(value) == expected
 
 
+class TestPairSpace:
+
+    def test_pair_index(self):
+        space = PairSpace.from_bench(Bench.from_file('example.txt'))
+        assert space.elements == ['B', 'C', 'H', 'N']
+        assert space.pair_index('CH') == 6
+        assert space.pair(6) == 'CH'
+
+    def test_transition_matrix(self):
+        space = PairSpace(['A', 'B'])
+        rules = {'AB': Rule.from_str('AB -> A')}
+        assert space.transition_matrix(rules) == [
+            [1, 0, 0, 0],  # AA has no rule
+            [1, 1, 0, 0],  # AB -> AA, AB
+            [0, 0, 1, 0],
+            [0, 0, 0, 1],
+        ]
+
+
+class TestCompiledRules:
+
+    def test_compile(self):
+        bench = Bench('AB', {'AB': Rule.from_str('AB -> A')})
+        rules = CompiledRules.compile(bench)
+        assert list(rules.first) == [0, 0, 2, 3]
+        assert list(rules.second) == [NO_PAIR, 1, NO_PAIR, NO_PAIR]
+
+    def test_step(self):
+        rules = CompiledRules.compile(Bench('AB', {'AB': Rule.from_str('AB -> A')}))
+        counts = rules.step(rules.pair_counts('ABBA'))
+        assert list(counts) == [1, 1, 1, 1]  # AB -> AA, AB while BB and BA stay
+
+    def test_simulate_overflow(self):
+        rules = CompiledRules.compile(Bench('AA', {'AA': Rule.from_str('AA -> A')}))
+        assert list(rules.simulate(rules.pair_counts('AA'), 70)) == [2 ** 70]
+
+
+@pytest.mark.parametrize('value, expected', (
+    ('40', 40),
+    ('10**9', 1_000_000_000),
+))
+def test_parse_steps(value, expected):
+    assert parse_steps(value) == expected
+
+
 class TestBench:
 
     def test_simulate_reaction(self):
@@ -65,6 +113,107 @@ class TestBench:
         bench.fast_simulate(40)
         assert bench.score() == 2158894777814
 
+    @pytest.mark.parametrize('filename', ('example.txt', 'input.txt'))
+    @pytest.mark.parametrize('turns', (0, 1, 10, 40, 200))
+    def test_matrix_simulate(self, filename, turns):
+        expected = Bench.from_file(filename)
+        expected.fast_simulate(turns)
+        bench = Bench.from_file(filename)
+        bench.matrix_simulate(turns)
+        assert bench._polymer_map == expected._polymer_map
+        assert bench.score() == expected.score()
+
+    def test_matrix_simulate_modulus(self):
+        bench = Bench.from_file('input.txt')
+        bench.matrix_simulate(40, 1_000_000_007)
+        assert bench.score() == 2158894777814 % 1_000_000_007
+
+    @staticmethod
+    def random_bench(seed: int, elements: str, max_turns: int) -> Tuple[Bench, Bench, int]:
+        """Two identical benches with random rules and the number of turns to simulate"""
+        rng = random.Random(seed)
+        rules = {
+            a + b: Rule.from_str(f'{a}{b} -> {rng.choice(elements)}')
+            for a in elements
+            for b in elements
+            if rng.random() < 0.7
+        }
+        polymer = ''.join(rng.choice(elements) for _ in range(rng.randint(2, 5)))
+        return Bench(polymer, dict(rules)), Bench(polymer, dict(rules)), rng.randint(3, max_turns)
+
+    @pytest.mark.parametrize('seed', range(200))
+    @pytest.mark.parametrize('modulus', (1_000_000_007, 101))
+    def test_matrix_simulate_modulus_random(self, seed, modulus):
+        exact, bench, turns = self.random_bench(seed, 'ABC', 60)
+        exact.matrix_simulate(turns)
+        bench.matrix_simulate(turns, modulus)
+        assert bench.score() == exact.score() % modulus
+
+    @pytest.mark.parametrize('seed', range(20))
+    def test_matrix_simulate_modulus_long(self, seed):
+        exact, bench, turns = self.random_bench(seed, 'ABCD', 5000)
+        exact.fast_simulate(turns)
+        bench.matrix_simulate(turns, 1_000_000_007)
+        assert bench.score() == exact.score() % 1_000_000_007
+
+    @pytest.mark.parametrize('seed', range(40))
+    def test_matrix_simulate_modulus_decimal(self, seed, monkeypatch):
+        monkeypatch.setattr(compute, 'EXACT_RANK_TURNS', 0)
+        exact, bench, turns = self.random_bench(seed, 'ABCD', 3000)
+        exact.fast_simulate(turns)
+        bench.matrix_simulate(turns, 1_000_000_007)
+        try:
+            score = bench.score()
+        except ValueError:
+            # only when the most or least common elements cannot be told apart with decimals
+            counts = sorted(exact._polymer_map.values())
+            assert (counts[1] - counts[0]) * 10 ** 25 < counts[1] or (counts[-1] - counts[-2]) * 10 ** 25 < counts[-1]
+        else:
+            assert score == exact.score() % 1_000_000_007
+
+    def test_matrix_simulate_modulus_close_counts(self):
+        # A and C counts only differ by a 249 digits number
+        rules = {
+            r.input: r
+            for r in map(Rule.from_str, (
+                'AA -> D', 'AB -> C', 'AC -> C', 'AD -> B', 'BA -> D', 'BB -> C', 'BC -> A', 'BD -> C',
+                'CA -> B', 'CB -> A', 'CC -> B', 'CD -> C', 'DA -> A', 'DB -> C', 'DC -> C', 'DD -> B',
+            ))
+        }
+        bench = Bench('ACD', rules)
+        bench.matrix_simulate(1500, 1_000_000_007)
+        assert bench.score() == 451623531
+
+    def test_matrix_simulate_modulus_tiny_count(self, monkeypatch):
+        # C stays at 1 while A and B double every step
+        rules = {r.input: r for r in map(Rule.from_str, ('AA -> A', 'BB -> B'))}
+        bench = Bench('AACBB', dict(rules))
+        bench.matrix_simulate(1100, 1_000_000_007)
+        assert set(bench._polymer_map) == {'A', 'B', 'C'}
+        assert bench.score() == 466428307
+
+        # past the exact ranking A and B have the same count, which decimals cannot tell
+        monkeypatch.setattr(compute, 'EXACT_RANK_TURNS', 0)
+        bench = Bench('AACBB', dict(rules))
+        bench.matrix_simulate(1100, 1_000_000_007)
+        assert set(bench._polymer_map) == {'A', 'B', 'C'}
+        with pytest.raises(ValueError):
+            bench.score()
+
+        # without B the tiny count of C is still ranked
+        bench = Bench('AACA', dict(rules))
+        bench.matrix_simulate(1100, 1_000_000_007)
+        assert bench.score() == (2 ** 1100 + 1) % 1_000_000_007  # A is also first, last and in AC
+
+    def test_matrix_simulate_modulus_row_scale(self):
+        rules = {
+            r.input: r
+            for r in map(Rule.from_str, ('AA -> A', 'AC -> C', 'BA -> A', 'BB -> A', 'BC -> C', 'CB -> B', 'CC -> B'))
+        }
+        bench = Bench('CCC', rules)
+        bench.matrix_simulate(11, 1_000_000_007)
+        assert bench.score() == 1471
+
     @pytest.mark.parametrize('value, expected', (
         ('NNCB', ['NN', 'NC', 'CB']),
     ))